@@ -0,0 +1,118 @@
+import os, sys, argparse, contextlib, multiprocessing
+import numpy as np
+import pandas as pd
+from corpus import iter_unimorph, SUFFIXES
+
+LEMMA = 0
+FEATS = 2
+# The files of a single split, in the order they're sampled
+SPLITS = ("trn", "ftune", "tst")
+
+
+def find_splits(root):
+    """Group the split files under root by (directory relative to root, language), mapping each to its split files"""
+    groups = {}
+    for directory, _, files in os.walk(root):
+        for fname in files:
+            name = fname
+            for suffix in SUFFIXES.values():
+                if name.endswith(suffix):
+                    name = name[:-len(suffix)]
+            lang, _, split = name.rpartition(".")
+            if lang and split in SPLITS:
+                groups.setdefault((os.path.relpath(directory, root), lang), {})[split] = os.path.join(directory, fname)
+    return groups
+
+
+def read_keys(paths):
+    """Read the split files of one language, hashing every line, lemma & feature set into integer keys shared by the splits"""
+    rows, lemmas, feats = {}, {}, {}
+    keys = {}
+    for split, path in paths.items():
+        split_keys = [(rows.setdefault("\t".join(fields), len(rows)), lemmas.setdefault(fields[LEMMA], len(lemmas)), feats.setdefault(fields[FEATS], len(feats)))
+            for fields in iter_unimorph(path)]
+        keys[split] = np.asarray(split_keys, dtype=np.int64).reshape(-1, 3)
+    return keys
+
+
+def overlap_pct(keys, seen):
+    """The percent of keys that are among the seen keys"""
+    return 100 * np.count_nonzero(np.isin(keys, seen)) / len(keys) if len(keys) else np.nan
+
+
+def audit_language(paths):
+    """Check the splits of one language for missing files, duplicate lines, leakage & overlap between train and test"""
+    keys = read_keys(paths)
+    empty = np.empty((0, 3), dtype=np.int64)
+    train, ftune, test = (keys.get(split, empty) for split in SPLITS)
+    seen = np.concatenate([train, ftune])
+    report = {"missing": ",".join(split for split in SPLITS if split not in paths)}
+    for split, split_keys in zip(SPLITS, (train, ftune, test)):
+        report[f"{split}_size"] = len(split_keys)
+        report[f"{split}_duplicates"] = len(split_keys) - len(np.unique(split_keys[:, 0]))
+    # Lines shared between splits that are meant to be disjoint
+    report["ftune_in_trn"] = len(np.intersect1d(ftune[:, 0], train[:, 0]))
+    report["tst_in_trn"] = len(np.intersect1d(test[:, 0], seen[:, 0]))
+    report["lemma_overlap"] = overlap_pct(test[:, 1], seen[:, 1])
+    report["feat_overlap"] = overlap_pct(test[:, 2], seen[:, 2])
+    return report
+
+
+def _audit_task(args):
+    """Audit one (directory, language) group in a worker process"""
+    (directory, lang), paths = args
+    return {"directory": directory, "language": lang, **audit_language(paths)}
+
+
+def audit_tree(root, jobs=1, overlap_item=None, overlap_ratio=None, tolerance=1.):
+    """Audit every language under a split tree, returning one row per (directory, language)
+
+    If overlap_item ("lemma" or "feat") and overlap_ratio are given, each language is also checked for having its
+    test overlap within tolerance percentage points of the requested ratio.
+    """
+    tasks = sorted(find_splits(root).items())
+    with multiprocessing.Pool(jobs) if jobs > 1 else contextlib.nullcontext() as pool:
+        reports = list(pool.imap(_audit_task, tasks, chunksize=8) if jobs > 1 else map(_audit_task, tasks))
+    df = pd.DataFrame(reports)
+    if len(df) and overlap_ratio is not None:
+        df["compliant"] = (df[f"{overlap_item}_overlap"] - 100 * overlap_ratio).abs() <= tolerance
+    return df
+
+
+def problems(df):
+    """Select the languages with missing files, duplicates, leakage or (if checked) the wrong overlap"""
+    bad = (df["missing"] != "") | (df[["trn_duplicates", "ftune_duplicates", "tst_duplicates", "ftune_in_trn", "tst_in_trn"]] > 0).any(axis=1)
+    if "compliant" in df:
+        bad |= ~df["compliant"]
+    return df[bad]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Audit split trees for leakage, duplicate lines & train-test overlap")
+    parser.add_argument("roots", help="The split trees to audit", nargs="+")
+    parser.add_argument("--out", help="Write the full per-language report to this TSV file")
+    parser.add_argument("--jobs", help="The number of languages to audit in parallel", type=int, default=1)
+    parser.add_argument("--overlap_item", help="Check the test overlap of this item (LEMMA or FEATS) against --overlap_ratio", default="LEMMA")
+    parser.add_argument("--overlap_ratio", help="The requested test overlap ratio of the splits", type=float)
+    parser.add_argument("--tolerance", help="How far (in percentage points) the test overlap may be from the requested ratio", type=float, default=1.)
+    args = parser.parse_args()
+
+    if args.overlap_item.strip().upper() == "LEMMA":
+        overlap_item = "lemma"
+    elif args.overlap_item.strip().upper() == "FEATS":
+        overlap_item = "feat"
+    else:
+        raise Exception("Overlap must be either lemma or features")
+    reports = []
+    for root in args.roots:
+        df = audit_tree(root, args.jobs, overlap_item, args.overlap_ratio, args.tolerance)
+        df.insert(0, "tree", root)
+        reports.append(df)
+    df = pd.concat(reports, ignore_index=True)
+    if args.out:
+        df.to_csv(args.out, sep="\t", index=False)
+    bad = problems(df) if len(df) else df
+    print(f"Audited {len(df)} languages in {len(args.roots)} trees; {len(bad)} with problems")
+    if len(bad):
+        print(bad.to_string(index=False))
+    sys.exit(1 if len(bad) else 0)
@@ -0,0 +1,230 @@
+import os, io, sys, json, time, random, argparse, platform, tempfile, contextlib, tracemalloc
+import numpy as np
+import overlap, make_splits, lemma_overlap_splits, evaluation
+from corpus import write_rows, LEMMA, FEATS
+
+# Parts of speech & feature values the synthetic feature bundles are built from
+POS = ("V", "N", "ADJ")
+VALUES = (("NOM", "ACC", "GEN", "DAT", "LOC", "INS", "ESS"), ("SG", "PL", "DU"), ("1", "2", "3"), ("PRS", "PST", "FUT"))
+
+
+def synthetic_bundles(num_bundles):
+    """Make num_bundles distinct UniMorph-style feature bundles out of the parts of speech & feature values"""
+    bundles = []
+    for k in range(num_bundles):
+        atoms = [POS[k % len(POS)]]
+        k //= len(POS)
+        for values in VALUES:
+            atoms.append(values[k % len(values)])
+            k //= len(values)
+        # Bundles past the first few hundred get an extra atom so that they stay distinct
+        if k:
+            atoms.append(f"X{k}")
+        bundles.append(";".join(atoms))
+    return bundles
+
+
+def synthetic_unimorph(num_triples, num_lemmas=None, num_bundles=200, paradigm_zipf=1.1, bundle_zipf=1.2, freq_zipf=1.5, seed=0):
+    """Generate a synthetic UniMorph corpus of about num_triples (lemma, inflection, features, frequency) rows
+
+    Paradigm sizes follow a Zipfian distribution over the lemmas (with exponent paradigm_zipf, capped at num_bundles),
+    every lemma's paradigm is filled with distinct feature bundles drawn in proportion to a Zipfian weight over the
+    bundles (bundle_zipf), and the frequency column is drawn from a Zipf distribution (freq_zipf). By default there
+    is one lemma for every ten triples.
+    """
+    rng = np.random.default_rng(seed)
+    num_lemmas = num_lemmas or max(1, num_triples // 10)
+    num_triples = min(num_triples, num_lemmas * num_bundles)
+    # Scale the Zipfian paradigm sizes so they add up to num_triples, then hand out what capping them lost
+    sizes = 1 / np.arange(1, num_lemmas + 1) ** paradigm_zipf
+    sizes = np.clip(np.floor(sizes / sizes.sum() * num_triples), 1, num_bundles).astype(np.int64)
+    while sizes.sum() < num_triples:
+        room = np.flatnonzero(sizes < num_bundles)
+        sizes[room[:num_triples - sizes.sum()]] += 1
+    sizes = sizes[rng.permutation(num_lemmas)]
+    bundles = synthetic_bundles(num_bundles)
+    weights = 1 / np.arange(1, num_bundles + 1) ** bundle_zipf
+    freqs = rng.zipf(freq_zipf, size=int(sizes.sum()))
+    triples = []
+    for lemma, size in enumerate(sizes.tolist()):
+        # Weighted sampling without replacement: the bundles with the smallest exponential keys
+        keys = rng.standard_exponential(num_bundles) / weights
+        for k in np.argpartition(keys, size - 1)[:size].tolist():
+            triples.append((f"lem{lemma}", f"lem{lemma}-{k}", bundles[k], str(freqs[len(triples)])))
+    return triples
+
+
+class PhaseTimer:
+    """Time the phases of a benchmark & (if tracing memory) record the peak memory allocated in each"""
+
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.phases = {}
+
+    @contextlib.contextmanager
+    def __call__(self, name):
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        # The split functions report their progress by printing; keep that out of the benchmark output
+        with contextlib.redirect_stdout(io.StringIO()):
+            yield
+        phase = {"seconds": time.perf_counter() - start}
+        if self.trace_memory:
+            phase["peak_mib"] = tracemalloc.get_traced_memory()[1] / 2**20
+        self.phases[name] = phase
+
+
+def bench_lemma_overlap_splits(workdir, triples, timer, overlap_item=LEMMA, joint=False, start1=False):
+    """Split a synthetic language with lemma_overlap_splits, from reading it in to writing the splits"""
+    n = len(triples)
+    train_path, gold_path = os.path.join(workdir, "train"), os.path.join(workdir, "gold")
+    # Spread the corpus over the train, dev & gold test files the splitter expects
+    write_rows(f"{train_path}/synthetic/syn.trn", [t[:3] for t in triples[:int(.8 * n)]])
+    write_rows(f"{train_path}/synthetic/syn.dev", [t[:3] for t in triples[int(.8 * n):int(.9 * n)]])
+    write_rows(f"{gold_path}/syn.tst", [t[:3] for t in triples[int(.9 * n):]])
+    trainsize, testsize = int(.4 * n), int(.1 * n)
+    random.seed(1)
+    with timer("read"):
+        corpus, line_dict = lemma_overlap_splits.read_corpus(f"{train_path}/synthetic/syn", f"{gold_path}/syn", overlap_item)
+    with timer("sample"):
+        if joint:
+            train, ftune, test = lemma_overlap_splits.joint_overlap_sample(corpus, list(range(len(corpus))), trainsize, testsize, .125, .5, .8)
+        else:
+            train, ftune, test = lemma_overlap_splits.controlled_overlap_sample(corpus, line_dict, list(range(len(corpus))), trainsize, testsize, .125, overlap_item, .5, start1)
+    with timer("validate"):
+        lemma_overlap_splits.validate(corpus, train, ftune, test, overlap_item)
+    with timer("write"):
+        lemma_overlap_splits.write_splits(os.path.join(workdir, "out"), "synthetic", "syn", 1, corpus.decode(train), corpus.decode(ftune), corpus.decode(test))
+
+
+def bench_make_splits(workdir, triples, timer):
+    """Run every make_splits sampling strategy over a synthetic language with a frequency column"""
+    n = len(triples)
+    freqfname = os.path.join(workdir, "syn.freq")
+    write_rows(freqfname, triples)
+    sizes = dict(testsize=int(.05 * n), dsize=int(.05 * n), ltsize=int(.3 * n), lftsize=int(.03 * n), stsize=int(.1 * n), sftsize=int(.01 * n))
+    with timer("read"):
+        corpus, order = make_splits.readcorpus(freqfname)
+    for name, weight in (("naive_uniform", False), ("naive_weighted", True)):
+        make_splits.set_seed("1")
+        with timer(name):
+            splits = make_splits.naive_sample(corpus, order, weight=weight, **sizes)
+    make_splits.set_seed("1")
+    with timer("feataware"):
+        splits = make_splits.nofreq_feataware_sample(corpus, list(range(len(corpus))), feat_overlap_ratio=.5, **sizes)
+    with timer("compute_overlaps"):
+        make_splits.compute_overlaps(corpus, *splits[:2], *splits[4:], *splits[2:4])
+    with timer("validate"):
+        make_splits.validate(*splits)
+
+
+def bench_compute_overlap(workdir, triples, timer):
+    """Compute the lemma & feature overlap between two halves of a synthetic language"""
+    half = len(triples) // 2
+    train, test = [t[:3] for t in triples[:half]], [t[:3] for t in triples[half:]]
+    with timer("index"):
+        trainindex, testindex = overlap.OverlapIndex(train), overlap.OverlapIndex(test)
+    with timer("overlap"):
+        trainindex.overlap(testindex, LEMMA)
+        trainindex.overlap(testindex, FEATS)
+
+
+def bench_evaluation(workdir, triples, timer):
+    """Evaluate a synthetic decode file against a split of a synthetic language"""
+    n = len(triples)
+    rng = np.random.default_rng(0)
+    order = rng.permutation(n)
+    splits = {"trn": order[:int(.7 * n)], "ftune": order[int(.7 * n):int(.8 * n)], "tst": order[int(.8 * n):]}
+    train_path = os.path.join(workdir, "eval", "syn")
+    for suffix, rows in splits.items():
+        write_rows(f"{train_path}.{suffix}", [triples[i][:3] for i in rows.tolist()])
+    # Half of the predictions are right (distance 0)
+    res_file = os.path.join(workdir, "eval", "syn..decode.tsv")
+    test = [triples[i] for i in splits["tst"].tolist()]
+    dists = rng.integers(0, 2, size=len(test)) * rng.integers(1, 5, size=len(test))
+    write_rows(res_file, [("prediction", "target", "loss", "dist")] + [(t[1], t[1], "0.0", str(d)) for t, d in zip(test, dists.tolist())])
+    with timer("evaluate"):
+        evaluation.evaluate_language(train_path, res_file)
+
+
+BENCHMARKS = {
+    "lemma_overlap_splits": bench_lemma_overlap_splits,
+    "lemma_overlap_splits_feats": lambda workdir, triples, timer: bench_lemma_overlap_splits(workdir, triples, timer, overlap_item=FEATS),
+    "lemma_overlap_splits_start1": lambda workdir, triples, timer: bench_lemma_overlap_splits(workdir, triples, timer, start1=True),
+    "lemma_overlap_splits_joint": lambda workdir, triples, timer: bench_lemma_overlap_splits(workdir, triples, timer, joint=True),
+    "make_splits": bench_make_splits,
+    "compute_overlap": bench_compute_overlap,
+    "evaluation": bench_evaluation,
+}
+
+
+def run_benchmark(name, triples, repeat=3, trace_memory=True):
+    """Run a benchmark repeat times, keeping the fastest time of each phase, plus once more to trace its memory"""
+    phases = {}
+    for _ in range(repeat):
+        timer = PhaseTimer()
+        with tempfile.TemporaryDirectory() as workdir:
+            BENCHMARKS[name](workdir, triples, timer)
+        for phase, result in timer.phases.items():
+            phases[phase] = min(phases.get(phase, result), result, key=lambda r: r["seconds"])
+    if trace_memory:
+        # Tracing slows everything down, so its timings are thrown away
+        timer = PhaseTimer(trace_memory=True)
+        tracemalloc.start()
+        try:
+            with tempfile.TemporaryDirectory() as workdir:
+                BENCHMARKS[name](workdir, triples, timer)
+        finally:
+            tracemalloc.stop()
+        for phase, result in timer.phases.items():
+            phases[phase]["peak_mib"] = result["peak_mib"]
+    return phases
+
+
+def run_suite(sizes, names, repeat=3, trace_memory=True, seed=0, **corpus_args):
+    """Run every benchmark on a synthetic corpus of every size, returning the results with what they were run on"""
+    results = []
+    for size in sizes:
+        triples = synthetic_unimorph(size, seed=seed, **corpus_args)
+        for name in names:
+            print(f"{name} ({len(triples)} triples)...", file=sys.stderr)
+            results.append({"benchmark": name, "size": len(triples), "phases": run_benchmark(name, triples, repeat, trace_memory)})
+    meta = {"time": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(), "numpy": np.__version__,
+        "platform": platform.platform(), "seed": seed, "repeat": repeat, **corpus_args}
+    return {"meta": meta, "results": results}
+
+
+def compare(old, new):
+    """Print the ratio of the new to the old time of every phase both runs have"""
+    old_phases = {(r["benchmark"], r["size"], phase): result for r in old["results"] for phase, result in r["phases"].items()}
+    for r in new["results"]:
+        for phase, result in r["phases"].items():
+            before = old_phases.get((r["benchmark"], r["size"], phase))
+            if before is not None:
+                print(f"{r['benchmark']}\t{r['size']}\t{phase}\t{before['seconds']:.4f}s -> {result['seconds']:.4f}s\t({result['seconds'] / before['seconds']:.2f}x)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the split strategies & the evaluator on synthetic UniMorph corpora")
+    parser.add_argument("out", help="The JSON file to write the results to")
+    parser.add_argument("--sizes", help="The numbers of triples to benchmark on", type=int, nargs="+", default=[10**3, 10**4, 10**5, 10**6])
+    parser.add_argument("--benchmarks", help="The benchmarks to run", nargs="+", choices=list(BENCHMARKS), default=list(BENCHMARKS))
+    parser.add_argument("--repeat", help="Keep the fastest of this many runs of each benchmark", type=int, default=3)
+    parser.add_argument("--no_memory", help="Don't trace the peak memory of each phase", action="store_true")
+    parser.add_argument("--lemmas", help="The number of lemmas (default: a tenth of the triples)", type=int)
+    parser.add_argument("--bundles", help="The number of distinct feature bundles", type=int, default=200)
+    parser.add_argument("--paradigm_zipf", help="The Zipf exponent of the paradigm sizes", type=float, default=1.1)
+    parser.add_argument("--bundle_zipf", help="The Zipf exponent of the feature bundle weights", type=float, default=1.2)
+    parser.add_argument("--freq_zipf", help="The Zipf exponent of the frequency column", type=float, default=1.5)
+    parser.add_argument("--seed", help="The random seed of the synthetic corpora", type=int, default=0)
+    parser.add_argument("--compare", help="An earlier results file to compare the timings against")
+    args = parser.parse_args()
+
+    results = run_suite(args.sizes, args.benchmarks, args.repeat, not args.no_memory, args.seed, num_lemmas=args.lemmas, num_bundles=args.bundles,
+        paradigm_zipf=args.paradigm_zipf, bundle_zipf=args.bundle_zipf, freq_zipf=args.freq_zipf)
+    with open(args.out, "w") as f:
+        json.dump(results, f, indent=1)
+    if args.compare:
+        with open(args.compare, "r") as f:
+            compare(json.load(f), results)
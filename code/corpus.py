@@ -0,0 +1,198 @@
+import os, io, gzip, hashlib, tempfile
+import numpy as np
+
+LEMMA = 0
+INFL = 1
+FEATS = 2
+FREQ = 3
+
+# Bump whenever the layout of the cached arrays changes
+CACHE_VERSION = 1
+
+# File suffixes of the supported output compressions
+SUFFIXES = {"gzip": ".gz", "zstd": ".zst"}
+
+# Temporary files are created private; give written files the permissions open() would have
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+
+class Corpus:
+    """UniMorph triples with their lemmas, inflections and feature sets interned to integer IDs
+
+    IDs are assigned in sorted order of the strings they stand for and rows are kept in sorted order of their
+    triples, so sorting IDs or rows gives the same order as sorting the strings or triples themselves. If the
+    frequency of each triple is given, freqs holds the frequency of every row (and is None otherwise).
+    """
+    __slots__ = ("vocab", "columns", "freqs")
+
+    def __init__(self, triples, freqs=None):
+        self.freqs = None
+        if freqs is not None:
+            # A triple listed more than once (e.g. in train & test) keeps its highest frequency
+            highest = {}
+            for triple, freq in zip(triples, freqs):
+                highest[triple] = max(freq, highest.get(triple, freq))
+        triples = sorted(set(triples))
+        if freqs is not None:
+            self.freqs = np.asarray([highest[triple] for triple in triples], dtype=np.float64)
+        self.vocab = tuple(sorted(set(triple[i] for triple in triples)) for i in (LEMMA, INFL, FEATS))
+        self.columns = np.empty((len(triples), 3), dtype=np.int32)
+        for i, vocab in enumerate(self.vocab):
+            ids = {item: n for n, item in enumerate(vocab)}
+            self.columns[:, i] = [ids[triple[i]] for triple in triples]
+
+    def __len__(self):
+        return len(self.columns)
+
+    def column(self, i):
+        """Return the IDs of item i (LEMMA, INFL or FEATS) for every row"""
+        return self.columns[:, i]
+
+    def decode(self, rows):
+        """Turn rows back into (lemma, inflection, features) triples"""
+        lemmas, infls, feats = self.vocab
+        return [(lemmas[l], infls[n], feats[f]) for l, n, f in self.columns[np.asarray(rows, dtype=np.int64)].tolist()]
+
+    def item_rows(self, i):
+        """Map the ID of each item i to the sorted array of rows containing it"""
+        order = np.argsort(self.columns[:, i], kind="stable")
+        bounds = np.searchsorted(self.columns[order, i], np.arange(len(self.vocab[i]) + 1))
+        return {item: order[bounds[item]:bounds[item + 1]] for item in range(len(self.vocab[i]))}
+
+
+class UniMorphTable:
+    """The columns of a UniMorph file in file order, with each column interned to integer IDs
+
+    vocab holds the distinct lemmas, inflections and feature sets in order of first appearance, ids holds the
+    (lemma, inflection, features) IDs of every line, and freqs holds the frequency column (0 if there isn't one).
+    """
+    __slots__ = ("vocab", "ids", "freqs")
+
+    def __init__(self, vocab, ids, freqs):
+        self.vocab = vocab
+        self.ids = ids
+        self.freqs = freqs
+
+    def __len__(self):
+        return len(self.ids)
+
+    def column(self, i):
+        """Return the strings of item i (LEMMA, INFL or FEATS) for every line"""
+        vocab = self.vocab[i]
+        return [vocab[n] for n in self.ids[:, i].tolist()]
+
+    def items(self, i):
+        """Return the set of distinct strings of item i"""
+        return set(self.vocab[i])
+
+    def triples(self):
+        """Return the (lemma, inflection, features) triple of every line"""
+        lemmas, infls, feats = self.vocab
+        return [(lemmas[l], infls[n], feats[f]) for l, n, f in self.ids.tolist()]
+
+
+def find_file(path):
+    """Return path, or its compressed version if only that exists"""
+    if not os.path.exists(path):
+        for suffix in SUFFIXES.values():
+            if os.path.exists(path + suffix):
+                return path + suffix
+    return path
+
+
+def _zstd():
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError("Reading or writing .zst files needs the zstandard package (pip install zstandard)")
+    return zstandard
+
+
+def open_text(path):
+    """Open a (possibly gzip or zstd compressed) text file for reading, picking the compression from its suffix"""
+    path = find_file(path)
+    if path.endswith(SUFFIXES["gzip"]):
+        return gzip.open(path, "rt")
+    if path.endswith(SUFFIXES["zstd"]):
+        return io.TextIOWrapper(_zstd().ZstdDecompressor().stream_reader(open(path, "rb"), closefd=True))
+    return open(path, "r")
+
+
+def write_text(path, text, compression=None):
+    """Write text to path in one go, compressing it if asked, and return the path written
+
+    The text goes to a temporary file in the same directory first, which is then renamed into place, so readers
+    never see a partly written file and re-running overwrites rather than appends.
+    """
+    data = text.encode()
+    if compression is not None:
+        if compression not in SUFFIXES:
+            raise ValueError(f"Unknown compression {compression!r}, expected one of {', '.join(SUFFIXES)}")
+        path += SUFFIXES[compression]
+        data = gzip.compress(data, mtime=0) if compression == "gzip" else _zstd().ZstdCompressor().compress(data)
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".", suffix=".tmp")
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    os.chmod(tmp_path, 0o666 & ~_UMASK)
+    os.replace(tmp_path, path)
+    return path
+
+
+def write_rows(path, rows, compression=None):
+    """Write rows of fields as tab-separated lines (see write_text)"""
+    return write_text(path, "".join("\t".join(row) + "\n" for row in rows), compression)
+
+
+def iter_unimorph(path):
+    """Stream the fields of every non-blank line of a (possibly compressed) UniMorph file"""
+    with open_text(path) as f:
+        for line in f:
+            if line.strip():
+                yield line.strip().split("\t")
+
+
+def file_hash(path):
+    """Hash the contents of a file without reading it into memory all at once"""
+    digest = hashlib.sha1()
+    with open(find_file(path), "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def parse_unimorph(path):
+    """Read every column of a UniMorph file (with an optional 4th frequency column) in a single pass"""
+    ids = ({}, {}, {})
+    rows = []
+    freqs = []
+    for n, fields in enumerate(iter_unimorph(path)):
+        if len(fields) not in (3, 4):
+            raise ValueError(f"{path}, line {n + 1}: expected 3 or 4 tab-separated columns, got {len(fields)}")
+        rows.append([column.setdefault(field, len(column)) for column, field in zip(ids, fields)])
+        freqs.append(float(fields[FREQ]) if len(fields) == 4 else 0.)
+    vocab = tuple(list(column) for column in ids)
+    return UniMorphTable(vocab, np.asarray(rows, dtype=np.int32).reshape(-1, 3), np.asarray(freqs, dtype=np.float64))
+
+
+def read_unimorph(path, cache_dir=None):
+    """Read a UniMorph file, reusing the parsed columns cached under cache_dir for files with the same contents"""
+    if cache_dir is None:
+        return parse_unimorph(path)
+    cache_path = os.path.join(cache_dir, f"{file_hash(path)}.v{CACHE_VERSION}.npz")
+    if os.path.exists(cache_path):
+        with np.load(cache_path) as cached:
+            vocab = tuple(str(cached[f"vocab{i}"]).split("\n") if cached[f"size{i}"] else [] for i in (LEMMA, INFL, FEATS))
+            return UniMorphTable(vocab, cached["ids"], cached["freqs"])
+    table = parse_unimorph(path)
+    # Write to a temporary file first so that concurrent readers never see a partial cache entry
+    os.makedirs(cache_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix=".npz")
+    with os.fdopen(fd, "wb") as f:
+        np.savez(f, ids=table.ids, freqs=table.freqs,
+            **{f"vocab{i}": np.array("\n".join(table.vocab[i])) for i in (LEMMA, INFL, FEATS)},
+            **{f"size{i}": len(table.vocab[i]) for i in (LEMMA, INFL, FEATS)})
+    os.replace(tmp_path, cache_path)
+    return table
@@ -1,97 +1,318 @@
-import sys, os, argparse
+import sys, os, re, argparse, json, hashlib, tempfile, itertools, contextlib, multiprocessing
+from collections import Counter
 import numpy as np 
 import pandas as pd 
+from corpus import read_unimorph, file_hash, find_file, open_text
+import profiling
 
 LEMMA = 0
 FEATS = 2
 INFL = 1
 FREQ = 3
 
-def read_train(train_path, include_ftune=True):
+# Bump whenever the evaluation changes, so that cached results are recomputed
+EVAL_VERSION = 1
+# A decode file separates the tokens of a word (characters, or e.g. <UNK>) by single spaces, so a space in the word is " " between separators
+DECODE_TOKEN = re.compile(r"([^ ]+| )(?: |$)")
+
+def read_train(train_path, include_ftune=True, cache_dir=None):
    """Helper function to read in the training data to get a set of the attested & unattested lemmas & featuresets"""
-   def get_seen(path, index):
-      return set([line.split("\t")[index].strip() for line in open(path, "r").readlines()])
-   # Get the lemmas and feature sets in train
-   seen_lemmas = get_seen(f"{train_path}.trn", 0)
-   seen_fts = get_seen(f"{train_path}.trn", 2)
+   # Get the lemmas and feature sets in train, reading both columns in one pass
+   train = read_unimorph(f"{train_path}.trn", cache_dir)
+   seen_lemmas = train.items(LEMMA)
+   seen_fts = train.items(FEATS)
    # If presence in finetune also constitutes presence in train, then include the lemmas and features seen there 
    if include_ftune: 
-      seen_lemmas = seen_lemmas.union(get_seen(f"{train_path}.ftune", 0))
-      seen_fts = seen_fts.union(get_seen(f"{train_path}.ftune", 2))
+      ftune = read_unimorph(f"{train_path}.ftune", cache_dir)
+      seen_lemmas = seen_lemmas.union(ftune.items(LEMMA))
+      seen_fts = seen_fts.union(ftune.items(FEATS))
    return seen_lemmas, seen_fts
 
 
 
-def evaluate(seen_lemmas, seen_fts, res_lines, ignore_fts_novel=True):
-   """The main evaluation function"""
-   seen_total = 0
-   seen_correct = 0
-   unseen_total = 0
-   unseen_correct = 0
-   for lemma, feats, correct in res_lines:
-      # If we're ignoring elements with novel features in our evaluation, then drop them here 
-      if ignore_fts_novel and feats not in seen_fts:
-         continue
-      # If the triple's lemma has been seen in train, tally accordingly 
-      if lemma in seen_lemmas:
-         seen_total += 1
-         if correct:
-            seen_correct += 1
-      # If the triple's lemma has not been seen in train, tally accordingly 
-      else: 
-         unseen_total += 1
-         if correct:
-            unseen_correct += 1
-   # Calculate & return percents 
-   return seen_correct/seen_total*100, unseen_correct/unseen_total*100
+def mark_seen(train, ftune, test):
+   """Mark once, for every test row, whether its lemma & feature set were seen in train & in train + ftune"""
+   marks = {}
+   for name, index in (("lemma", LEMMA), ("fts", FEATS)):
+      train_items = train.items(index)
+      seen_items = train_items.union(ftune.items(index))
+      # Look up each distinct test item once, then spread the result over the rows via the interned IDs
+      vocab = test.vocab[index]
+      ids = test.ids[:, index]
+      marks[f"train_{name}"] = np.fromiter((x in train_items for x in vocab), dtype=bool, count=len(vocab))[ids]
+      marks[f"seen_{name}"] = np.fromiter((x in seen_items for x in vocab), dtype=bool, count=len(vocab))[ids]
+   return marks
+
+
+
+def evaluate(marks, correct):
+   """The main evaluation function, computing all of the seen / unseen accuracies & their counts from masked sums"""
+   scores = {}
+   # "seen" counts presence in train + ftune as seen, "train" only counts presence in train
+   for seen, unseen in (("seen", "unseen"), ("train", "untrain")):
+      seen_lemmas = marks[f"{seen}_lemma"]
+      # With the _t suffix we ignore elements with novel features, with the _f suffix we keep them
+      for suffix, kept in (("t", marks[f"{seen}_fts"]), ("f", np.ones_like(seen_lemmas))):
+         for name, mask in ((seen, kept & seen_lemmas), (unseen, kept & ~seen_lemmas)):
+            total = np.count_nonzero(mask)
+            scores[f"{name}_pct_{suffix}"] = np.count_nonzero(mask & correct)/total*100 if total else np.nan
+            scores[f"{name}_n_{suffix}"] = total
+   return scores
+
+
+
+class DecodeTable:
+   """The columns of a decode file: the predicted & target inflections (as space-separated characters), the loss & the edit distance"""
+   __slots__ = ("prediction", "target", "loss", "dist")
+
+   def __init__(self, prediction, target, loss, dist):
+      self.prediction = prediction
+      self.target = target
+      self.loss = loss
+      self.dist = dist
+
+   def __len__(self):
+      return len(self.dist)
+
+
+
+def find_decode_file(res_path, family, lang):
+   """Find a language's decode file, either nested as {res}/{family}/{lang}/{lang}..decode.tsv or flat as {res}/{family}/{lang}..decode.tsv"""
+   nested = f"{res_path}/{family}/{lang}/{lang}..decode.tsv"
+   flat = f"{res_path}/{family}/{lang}..decode.tsv"
+   return nested if os.path.exists(find_file(nested)) or not os.path.exists(find_file(flat)) else flat
+
+
+
+def iter_decode(res_file, chunk_size=1 << 16):
+   """Stream a decode file as DecodeTables of at most chunk_size rows each, so only one chunk is ever held as Python strings"""
+   with open_text(res_file) as f:
+      # A decode file that has only just been created may not even hold its header yet
+      if next(f, None) is None:
+         return
+      while True:
+         rows = [line.rstrip("\n").split("\t") for line in itertools.islice(f, chunk_size)]
+         rows = [row for row in rows if row != [""]]
+         if not rows:
+            return
+         prediction, target, loss, dist = zip(*rows)
+         yield DecodeTable(np.asarray(prediction, dtype=str), np.asarray(target, dtype=str), np.asarray(loss, dtype=np.float64), np.asarray(dist, dtype=np.int64))
+
+
+
+def read_decode(res_file):
+   """Read every column of a decode file into typed arrays"""
+   chunks = list(iter_decode(res_file))
+   if not chunks:
+      return DecodeTable(np.empty(0, dtype=str), np.empty(0, dtype=str), np.empty(0, dtype=np.float64), np.empty(0, dtype=np.int64))
+   return DecodeTable(*(np.concatenate([getattr(chunk, column) for chunk in chunks]) for column in DecodeTable.__slots__))
+
+
+
+def align(prediction, target):
+   """Align the characters of a prediction with those of its target by edit distance, returning the (target, predicted)
+   character pairs that differ, with "" standing in for an inserted or deleted character"""
+   prediction, target = DECODE_TOKEN.findall(prediction), DECODE_TOKEN.findall(target)
+   n, m = len(target), len(prediction)
+   costs = np.zeros((n + 1, m + 1), dtype=np.int64)
+   costs[:, 0] = np.arange(n + 1)
+   costs[0, :] = np.arange(m + 1)
+   for i in range(1, n + 1):
+      for j in range(1, m + 1):
+         costs[i, j] = min(costs[i - 1, j] + 1, costs[i, j - 1] + 1, costs[i - 1, j - 1] + (target[i - 1] != prediction[j - 1]))
+   # Walk back through the table, preferring substitutions over insertions & deletions
+   pairs = []
+   i, j = n, m
+   while i > 0 or j > 0:
+      if i > 0 and j > 0 and costs[i, j] == costs[i - 1, j - 1] + (target[i - 1] != prediction[j - 1]):
+         if target[i - 1] != prediction[j - 1]:
+            pairs.append((target[i - 1], prediction[j - 1]))
+         i, j = i - 1, j - 1
+      elif i > 0 and costs[i, j] == costs[i - 1, j] + 1:
+         pairs.append((target[i - 1], ""))
+         i -= 1
+      else:
+         pairs.append(("", prediction[j - 1]))
+         j -= 1
+   return pairs[::-1]
 
 
 
+def error_analysis(train_path, res_file, cache_dir=None):
+   """Break down the errors of a language's decoded results by whether the lemma & feature set of each test row were seen
+
+   Returns a frame with the number of rows, accuracy, mean edit distance & loss distribution of every (lemma, feats)
+   group of seen / unseen (in train + ftune), and a frame of the (target, predicted) character confusion counts of
+   each group, with "" for inserted & deleted characters. The decode file is streamed chunk by chunk.
+   """
+   train = read_unimorph(f"{train_path}.trn", cache_dir)
+   ftune = read_unimorph(f"{train_path}.ftune", cache_dir)
+   test = read_unimorph(f"{train_path}.tst", cache_dir)
+   marks = mark_seen(train, ftune, test)
+   groups = [(lemma, feats) for lemma in ("seen", "unseen") for feats in ("seen", "unseen")]
+   losses = {group: [] for group in groups}
+   dists = {group: [] for group in groups}
+   confusions = {group: Counter() for group in groups}
+   offset = 0
+   for chunk in iter_decode(res_file):
+      # Only analyse the test rows that have a decoded result
+      num_rows = max(0, min(len(chunk), len(test) - offset))
+      seen_lemma = marks["seen_lemma"][offset:offset + num_rows]
+      seen_fts = marks["seen_fts"][offset:offset + num_rows]
+      for lemma, feats in groups:
+         mask = (seen_lemma == (lemma == "seen")) & (seen_fts == (feats == "seen"))
+         losses[lemma, feats].append(chunk.loss[:num_rows][mask])
+         dists[lemma, feats].append(chunk.dist[:num_rows][mask])
+         # Only the wrong predictions need aligning
+         wrong = np.flatnonzero(mask & (chunk.dist[:num_rows] > 0))
+         for prediction, target in zip(chunk.prediction[wrong].tolist(), chunk.target[wrong].tolist()):
+            confusions[lemma, feats].update(align(prediction, target))
+      offset += num_rows
+   rows = []
+   for lemma, feats in groups:
+      loss = np.concatenate(losses[lemma, feats])
+      dist = np.concatenate(dists[lemma, feats])
+      row = {"lemma": lemma, "feats": feats, "n": len(dist)}
+      if len(dist):
+         row.update(accuracy=np.count_nonzero(dist == 0)/len(dist)*100, mean_dist=dist.mean(), mean_loss=loss.mean(),
+            **{f"loss_p{q}": v for q, v in zip((10, 25, 50, 75, 90), np.percentile(loss, (10, 25, 50, 75, 90)))})
+      rows.append(row)
+   confusion_rows = [{"lemma": lemma, "feats": feats, "target": target, "prediction": prediction, "count": count}
+      for (lemma, feats), counts in confusions.items() for (target, prediction), count in counts.most_common()]
+   return pd.DataFrame(rows), pd.DataFrame(confusion_rows, columns=["lemma", "feats", "target", "prediction", "count"])
+
+
+
+def evaluate_language(train_path, res_file, cache_dir=None):
+   """Evaluate the decoded results for a single language against its train / ftune / test split"""
+   train = read_unimorph(f"{train_path}.trn", cache_dir)
+   ftune = read_unimorph(f"{train_path}.ftune", cache_dir)
+   test = read_unimorph(f"{train_path}.tst", cache_dir)
+   # Read in the edit distances from the decoded file; a prediction is correct if its distance is 0
+   dists = read_decode(res_file).dist
+   # Only score the test rows that have a decoded result
+   num_rows = min(len(test), len(dists))
+   marks = {k: v[:num_rows] for k, v in mark_seen(train, ftune, test).items()}
+   scores = evaluate(marks, dists[:num_rows] == 0)
+   scores["seen_lemmas"] = len(train.items(LEMMA).union(ftune.items(LEMMA)))
+   scores["train_lemmas"] = len(train.items(LEMMA))
+   return scores
+
+
+
+def evaluate_many(runs, cache_dir=None, profiler=profiling.NULL):
+   """Evaluate many languages / seeds at once, given (labels, train_path, res_file) triples, returning a tidy frame with one row per run"""
+   rows = []
+   for labels, train_path, res_file in runs:
+      with profiler.child(**labels).phase("evaluate") as record:
+         rows.append({**labels, **evaluate_language(train_path, res_file, cache_dir)})
+         record["test"] = rows[-1]["seen_n_f"] + rows[-1]["unseen_n_f"]
+   return pd.DataFrame(rows)
+
+
+
+def evaluate_cached(labels, train_path, res_file, cache_dir=None):
+   """Evaluate a single language, reusing the cached result if none of its split or decode files have changed"""
+   if cache_dir is None:
+      return {**labels, **evaluate_language(train_path, res_file)}
+   # Key the result on the contents of every file it depends on
+   paths = [f"{train_path}.trn", f"{train_path}.ftune", f"{train_path}.tst", res_file]
+   key = hashlib.sha1(f"{EVAL_VERSION}:{':'.join(file_hash(p) for p in paths)}".encode()).hexdigest()
+   result_path = os.path.join(cache_dir, "results", f"{key}.json")
+   if os.path.exists(result_path):
+      with open(result_path, "r") as f:
+         return {**labels, **json.load(f)}
+   scores = evaluate_language(train_path, res_file, cache_dir)
+   # Write to a temporary file first so that concurrent workers never see a partial result
+   os.makedirs(os.path.dirname(result_path), exist_ok=True)
+   fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(result_path), suffix=".json")
+   with os.fdopen(fd, "w") as f:
+      json.dump({k: v.item() if isinstance(v, np.generic) else v for k, v in scores.items()}, f)
+   os.replace(tmp_path, result_path)
+   return {**labels, **scores}
+
+
+
+def _evaluate_tree_task(args):
+   """Evaluate a language of a tree in a worker process, returning its scores, its error analysis (if asked for) & its profile records"""
+   labels, train_path, res_file, cache_dir, profile, errors = args
+   profiler = profiling.Profiler(**labels) if profile else profiling.NULL
+   with profiler.phase("evaluate") as record:
+      scores = evaluate_cached(labels, train_path, res_file, cache_dir)
+      record["test"] = scores["seen_n_f"] + scores["unseen_n_f"]
+   analysis = error_analysis(train_path, res_file, cache_dir) if errors else None
+   return scores, analysis, list(profiler.records)
+
+
+
+def evaluate_tree(train_tree, res_tree, out_path, jobs=1, cache_dir=None, profile=False, errors=False):
+   """Evaluate every seed / family / language of a split tree against a tree of decoded results laid out the same way
+
+   The profile & error analysis are written next to out_path as main writes them, with the seed, family & language of each row.
+   """
+   train_tree = train_tree.rstrip("/")
+   res_tree = res_tree.rstrip("/")
+   tasks = []
+   for seed in sorted(s for s in os.listdir(res_tree) if os.path.isdir(f"{train_tree}/{s}")):
+      for family in sorted(f for f in os.listdir(f"{res_tree}/{seed}") if "." not in f):
+         for lang in sorted(set([l.strip().split(".")[0] for l in os.listdir(f"{res_tree}/{seed}/{family}")])):
+            res_file = find_decode_file(f"{res_tree}/{seed}", family, lang)
+            # Only evaluate the languages whose model has finished decoding
+            if os.path.exists(find_file(res_file)):
+               tasks.append(({"seed": seed, "family": family, "lang": lang}, f"{train_tree}/{seed}/{family}/{lang}", res_file, cache_dir, profile, errors))
+   print(f"Evaluating {len(tasks)} languages...")
+   with multiprocessing.Pool(jobs) if jobs > 1 else contextlib.nullcontext() as pool:
+      results = list(pool.imap(_evaluate_tree_task, tasks) if jobs > 1 else map(_evaluate_tree_task, tasks))
+   out_base = os.path.splitext(out_path)[0]
+   if profile:
+      with open(f"{out_base}.profile.jsonl", "w") as f:
+         profiling.write_records(f, [record for _, _, records in results for record in records])
+   print("Writing output...")
+   pd.DataFrame([scores for scores, _, _ in results]).to_csv(out_path, index=False)
+   if errors and results:
+      analyses = [(task[0], *analysis) for task, (_, analysis, _) in zip(tasks, results)]
+      pd.concat([summary.assign(**labels) for labels, summary, _ in analyses], ignore_index=True).to_csv(f"{out_base}.errors.csv", index=False)
+      pd.concat([confusions.assign(**labels) for labels, _, confusions in analyses], ignore_index=True).to_csv(f"{out_base}.confusions.csv", index=False)
+
+
 
-def main(train_path, res_path, out_path):
+def main(train_path, res_path, out_path, cache_dir=None, profile=False, errors=False):
    """The main function which executes the evaluation loop """
    train_path = train_path[:-1] if train_path[-1] == "/" else train_path
    res_path = res_path[:-1] if res_path[-1] == "/" else res_path
-   evaluation_dict = {}
-   for family in [f for f in os.listdir(res_path) if "." not in f]:
+   runs = []
+   for family in sorted(f for f in os.listdir(res_path) if "." not in f):
       print(f"Processing {family}...")
       for lang in sorted(set([l.strip().split(".")[0] for l in os.listdir(f"{res_path}/{family}")])):
-         # Read in the lines from the testing file input to the model
-         test_lines = [tuple(line.strip().split("\t")) for line in open(f"{train_path}/{family}/{lang}.tst").readlines()]
-         # Read in the lines from the decoded file 
-         decode_lines = [int(line.strip().split("\t")[-1]) for line in open(f"{res_path}/{family}/{lang}/{lang}..decode.tsv").readlines()[1:]]
-         # Combine to (lemma, feature, correct) triples
-         res_lines = [(x[0], x[2], y == 0) for x, y in zip(test_lines, decode_lines)]
-         # Get the set of seen lemmas and features in train + dev to conduct the evaluation 
-         seen_lemmas, seen_fts = read_train(f"{train_path}/{family}/{lang}", include_ftune=True)
-         seen_pct_t, unseen_pct_t = evaluate(seen_lemmas, seen_fts, res_lines, ignore_fts_novel=True)
-         seen_pct_f, unseen_pct_f = evaluate(seen_lemmas, seen_fts, res_lines, ignore_fts_novel=False)
-         # Get the set of lemmas and features in train only to conduct the evaluation
-         train_lemmas, train_fts = read_train(f"{train_path}/{family}/{lang}", include_ftune=False)
-         train_pct_t, untrain_pct_t = evaluate(train_lemmas, train_fts, res_lines, ignore_fts_novel=True)
-         train_pct_f, untrain_pct_f = evaluate(train_lemmas, train_fts, res_lines, ignore_fts_novel=False)
-         
-         evaluation_dict[lang] = {
-            "family": family,
-            "seen_pct_t": seen_pct_t,
-            "unseen_pct_t": unseen_pct_t,
-            "seen_pct_f": seen_pct_f,
-            "unseen_pct_f": unseen_pct_f,
-            "train_pct_t": train_pct_t,
-            "untrain_pct_t": untrain_pct_t,
-            "train_pct_f": train_pct_f,
-            "untrain_pct_f": untrain_pct_f,
-            "seen_lemmas": len(set(seen_lemmas)),
-            "train_lemmas": len(set(train_lemmas))
-         }
+         runs.append(({"lang": lang, "family": family}, f"{train_path}/{family}/{lang}", find_decode_file(res_path, family, lang)))
+   profiler = profiling.Profiler() if profile else profiling.NULL
+   evaluation_df = evaluate_many(runs, cache_dir, profiler)
+   if profile:
+      with open(f"{os.path.splitext(out_path)[0]}.profile.jsonl", "w") as f:
+         profiling.write_records(f, profiler.records)
    print("Writing output...")
-   evaluation_df = pd.DataFrame.from_dict(evaluation_dict).transpose()
+   columns = ["family", "seen_pct_t", "unseen_pct_t", "seen_pct_f", "unseen_pct_f", "train_pct_t", "untrain_pct_t", "train_pct_f", "untrain_pct_f", "seen_lemmas", "train_lemmas"]
+   evaluation_df = evaluation_df.set_index("lang")[columns].rename_axis(None)
    evaluation_df.to_csv(out_path)
+   if errors:
+      print("Analysing errors...")
+      analyses = [(labels, *error_analysis(split_path, res_file, cache_dir)) for labels, split_path, res_file in runs]
+      out_base = os.path.splitext(out_path)[0]
+      pd.concat([summary.assign(**labels) for labels, summary, _ in analyses], ignore_index=True).to_csv(f"{out_base}.errors.csv", index=False)
+      pd.concat([confusions.assign(**labels) for labels, _, confusions in analyses], ignore_index=True).to_csv(f"{out_base}.confusions.csv", index=False)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Evaluate train/dev/test splits with controlled overlap")
     parser.add_argument("train_path", help = "Path to the directory containing the train/dev/test splits")
     parser.add_argument("res_path", help="Path to the directory containing the splits")
     parser.add_argument("out_path", help="Path to write the results to")
+    parser.add_argument("--cache_dir", help="Cache the parsed split files (and, with --batch, each language's results) in this directory so later runs can skip them")
+    parser.add_argument("--batch", action="store_true", help="Treat the paths as trees with one subdirectory per seed & write one merged CSV with a seed column")
+    parser.add_argument("--jobs", type=int, default=1, help="The number of languages to evaluate in parallel with --batch")
+    parser.add_argument("--profile", action="store_true", help="Write the time & memory of evaluating each language next to the output, as <out_path without extension>.profile.jsonl")
+    parser.add_argument("--errors", action="store_true", help="Also break down the errors by seen / unseen lemma & feature set, writing <out_path without extension>.errors.csv & .confusions.csv")
     args = parser.parse_args()
-    main(args.train_path, args.res_path, args.out_path)
\ No newline at end of file
+    if args.batch:
+        evaluate_tree(args.train_path, args.res_path, args.out_path, args.jobs, args.cache_dir, args.profile, args.errors)
+    else:
+        main(args.train_path, args.res_path, args.out_path, args.cache_dir, args.profile, args.errors)
\ No newline at end of file
@@ -0,0 +1,79 @@
+import numpy as np
+from scipy import sparse
+from corpus import FEATS
+
+# Where a feature bundle falls relative to the bundles seen in train
+SEEN, NOVEL_COMBINATION, NOVEL_ATOM = 0, 1, 2
+
+
+class FeatureAtomIndex:
+    """Feature bundles (e.g. "V;IND;PRS;3;SG") decomposed into their atoms (the ;-separated features)
+
+    Each distinct bundle is parsed only once. incidence is the sparse bundles x atoms matrix of which atoms each
+    bundle holds, and bits holds the same as one bitset (a row of 64-bit words) per bundle, so sets of atoms can be
+    combined & compared with bitwise operations over whole arrays of bundles at a time.
+    """
+    __slots__ = ("bundles", "atoms", "bundle_ids", "incidence", "bits")
+
+    def __init__(self, bundles):
+        self.bundles = tuple(dict.fromkeys(bundles))
+        self.bundle_ids = {bundle: n for n, bundle in enumerate(self.bundles)}
+        atom_ids = {}
+        rows, cols = [], []
+        for n, bundle in enumerate(self.bundles):
+            for atom in bundle.strip().split(";"):
+                if atom:
+                    rows.append(n)
+                    cols.append(atom_ids.setdefault(atom, len(atom_ids)))
+        self.atoms = tuple(atom_ids)
+        rows, cols = np.asarray(rows, dtype=np.int64), np.asarray(cols, dtype=np.int64)
+        self.incidence = sparse.csr_matrix((np.ones(len(rows), dtype=bool), (rows, cols)), shape=(len(self.bundles), len(self.atoms)))
+        self.bits = np.zeros((len(self.bundles), max(1, -(-len(self.atoms) // 64))), dtype=np.uint64)
+        np.bitwise_or.at(self.bits, (rows, cols // 64), np.left_shift(np.uint64(1), (cols % 64).astype(np.uint64)))
+
+    def __len__(self):
+        return len(self.bundles)
+
+    def lookup(self, bundles):
+        """Get the index IDs of bundles (which must all be in the index)"""
+        return np.fromiter((self.bundle_ids[bundle] for bundle in bundles), dtype=np.int64, count=len(bundles))
+
+    def table_ids(self, table):
+        """Get the index ID of the bundle of every line of a UniMorphTable"""
+        return self.lookup(table.vocab[FEATS])[table.ids[:, FEATS]]
+
+    def atom_set(self, ids):
+        """Get the bitset of every atom held by any of the bundles with the given IDs"""
+        return np.bitwise_or.reduce(self.bits[np.asarray(ids, dtype=np.int64)], axis=0) if len(ids) else np.zeros(self.bits.shape[1], dtype=np.uint64)
+
+    def atom_mask(self, ids):
+        """Get a boolean mask over the atoms of whether each is held by any of the bundles with the given IDs"""
+        mask = np.zeros(len(self.atoms), dtype=bool)
+        mask[self.incidence[np.unique(np.asarray(ids, dtype=np.int64))].indices] = True
+        return mask
+
+    def atom_counts(self, ids):
+        """Count how many of the given bundle IDs (e.g. one per line, so repeats count) hold each atom"""
+        bundle_counts = np.bincount(np.asarray(ids, dtype=np.int64), minlength=len(self.bundles))
+        return self.incidence.T.astype(np.int64) @ bundle_counts
+
+    def atoms_seen(self, ids, seen_ids):
+        """Mark, for each of the given bundle IDs, whether all of its atoms occur in the bundles with seen_ids"""
+        unseen = ~self.atom_set(seen_ids)
+        return ~np.any(self.bits[np.asarray(ids, dtype=np.int64)] & unseen, axis=1)
+
+    def classify(self, ids, seen_ids):
+        """Classify each of the given bundle IDs as SEEN (the bundle occurs among seen_ids), NOVEL_COMBINATION (it doesn't,
+        but all of its atoms do) or NOVEL_ATOM (it has an atom that doesn't occur among seen_ids)"""
+        ids = np.asarray(ids, dtype=np.int64)
+        seen = np.zeros(len(self.bundles), dtype=bool)
+        seen[np.asarray(seen_ids, dtype=np.int64)] = True
+        classes = np.where(self.atoms_seen(ids, seen_ids), NOVEL_COMBINATION, NOVEL_ATOM)
+        classes[seen[ids]] = SEEN
+        return classes
+
+    def atom_overlap(self, ids, seen_ids):
+        """The proportion of atom tokens across the given bundle IDs that occur in the bundles with seen_ids"""
+        counts = self.atom_counts(ids)
+        total = counts.sum()
+        return counts[self.atom_mask(seen_ids)].sum() / total if total else np.nan
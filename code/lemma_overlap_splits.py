@@ -1,143 +1,191 @@
-import sys, os, argparse, random
+import sys, os, io, argparse, random, heapq, contextlib, multiprocessing
 import numpy as np 
+import overlap, manifest, profiling
+from corpus import Corpus, read_unimorph, write_rows, SUFFIXES
 LEMMA = 0
 FEATS = 2
 INFL = 1
 FREQ = 3
+# Control the overlap of lemmas & feature sets at the same time
+BOTH = -1
+# Bump whenever a change to the sampling changes the splits made from the same inputs & parameters
+SPLIT_VERSION = 2
 
 
 
-def write_splits(outdir, family, lang, seed, train, ftune, test):
-   """This function writes out the files"""
-   if not os.path.exists(f"{outdir}/{seed}/{family}"):
-      os.makedirs(f"{outdir}/{seed}/{family}")
-   with open(f"{outdir}/{seed}/{family}/{lang}.trn", "a") as trn:
-      for t1, t2, t3 in train:
-         trn.write(f"{t1}\t{t2}\t{t3}\n")
-   trn.close()
-   with open(f"{outdir}/{seed}/{family}/{lang}.ftune", "a") as ft:
-      for t1, t2, t3 in ftune:
-         ft.write(f"{t1}\t{t2}\t{t3}\n")
-   ft.close()
-   with open(f"{outdir}/{seed}/{family}/{lang}.tst", "a") as tst:
-      for t1, t2, t3 in test:
-         tst.write(f"{t1}\t{t2}\t{t3}\n")
-   ft.close()
+def write_splits(outdir, family, lang, seed, train, ftune, test, compression=None):
+   """This function writes out the files, replacing any left from an earlier run, and returns their paths"""
+   return [write_rows(f"{outdir}/{seed}/{family}/{lang}.{suffix}", split, compression) for split, suffix in ((train, "trn"), (ftune, "ftune"), (test, "tst"))]
 
 
 def compute_overlap(train, test, overlap_item, printoverlap=False):
    """Compute the overlap between the train and test data"""
-   trainitems = [triple[overlap_item] for triple in train]
-   testitems = [triple[overlap_item] for triple in test]
-   numtestoverlap = len([i for i in testitems if i in trainitems])
-   numtrainoverlap = len([i for i in trainitems if i in testitems])
-   
+   train_overlap, test_overlap = overlap.compute_overlap(train, test, i=overlap_item)
    if printoverlap:
-      print(f"\t\t{'Lemma' if overlap_item == LEMMA else 'Feature'} overlap in train: {100*numtrainoverlap/len(trainitems)}")
-      print(f"\t\t{'Lemma' if overlap_item == LEMMA else 'Feature'} overlap in test: {100*numtestoverlap/len(testitems)}")
+      print(f"\t\t{'Lemma' if overlap_item == LEMMA else 'Feature'} overlap in train: {train_overlap}")
+      print(f"\t\t{'Lemma' if overlap_item == LEMMA else 'Feature'} overlap in test: {test_overlap}")
+   return train_overlap, test_overlap
 
-   return 100*numtrainoverlap/len(trainitems), 100*numtestoverlap/len(testitems)
 
-
-def validate(train, ftune, test, overlap_item, printoverlap=False):
-   """Validate our train / ftune / test splits"""
-   train_all = set(train).union(set(ftune))
-   testset = set(test)
-   assert(len(train_all.intersection(testset)) == 0)
+def validate(corpus, train, ftune, test, overlap_item, printoverlap=False):
+   """Validate our train / ftune / test splits, given as rows of the corpus"""
+   train_all = np.union1d(train, ftune)
+   testset = np.unique(test)
+   leaked = len(np.intersect1d(train_all, testset, assume_unique=True))
+   assert(leaked == 0)
    if printoverlap:
-      print(f"\t\tTriple overlap between train and test: {len(train_all.intersection(testset))}")
-   train_overlap, test_overlap = compute_overlap(train_all, testset, overlap_item=overlap_item, printoverlap=printoverlap)
+      print(f"\t\tTriple overlap between train and test: {leaked}")
+   # Index the lemmas & features of each side once & reuse them for both overlap items
+   train_index = overlap.OverlapIndex.from_columns(corpus.column(LEMMA)[train_all], corpus.column(FEATS)[train_all])
+   test_index = overlap.OverlapIndex.from_columns(corpus.column(LEMMA)[testset], corpus.column(FEATS)[testset])
+   train_overlap, test_overlap = compute_overlap(train_index, test_index, overlap_item=overlap_item, printoverlap=printoverlap)
    assert(test_overlap <= 50)
    other = [x for x in (LEMMA, FEATS)if x != overlap_item][0]
-   train_overlap2, test_overlap2 = compute_overlap(train_all, testset, overlap_item = other, printoverlap = False)
+   train_overlap2, test_overlap2 = compute_overlap(train_index, test_index, overlap_item = other, printoverlap = False)
    print(f"\t\t{'Lemma' if other == LEMMA else 'Feature'} overlap in test: {test_overlap2}")
    return test_overlap, test_overlap2
 
 
-def read_corpus(train_path, gold_path, overlap_item):
-   """Read in the data for a single language and create a mapping from the relevant overlap items to the triples containing that item"""
-   def parse_unimorph(path):
-      return [tuple(line.strip().split("\t")) for line in open(path, "r").readlines()]
+def read_corpus(train_path, gold_path, overlap_item, cache_dir=None, weighted=False, freq_path=None):
+   """Read in the data for a single language and create a mapping from the relevant overlap items to the rows containing that item
+
+   If weighted, the corpus also holds the frequency of every triple, from the frequency list at freq_path if given
+   and otherwise from the 4th column of the files themselves (triples without one have frequency 0).
+   """
    # Read in the train & dev data & the gold test data, which is in a different folder 
-   train_lines = parse_unimorph(f"{train_path}.trn")
-   dev_lines = parse_unimorph(f"{train_path}.dev")
-   test_lines = parse_unimorph(f"{gold_path}.tst")
-   # Get the set of all lines 
-   all_lines = sorted(set(train_lines + dev_lines + test_lines))
-   # Get the mapping from the relevant overlap item to the triples containing it
-   line_dict = {}
-   for triple in all_lines:
-      if triple[overlap_item] not in line_dict:
-         line_dict[triple[overlap_item]] = set()
-      line_dict[triple[overlap_item]].add(triple)
-   return all_lines, line_dict
-
-
-def subsample(line_dict, triples, overlappable, numsample, overlap_ratio, overlap_item):
-   """Helper function to sample our dev and test once we've sampled train"""
+   tables = [read_unimorph(f"{train_path}.trn", cache_dir), read_unimorph(f"{train_path}.dev", cache_dir), read_unimorph(f"{gold_path}.tst", cache_dir)]
+   lines = [triple for table in tables for triple in table.triples()]
+   freqs = None
+   if weighted and freq_path is not None:
+      freq_table = read_unimorph(freq_path, cache_dir)
+      freq_of = dict(zip(freq_table.triples(), freq_table.freqs.tolist()))
+      freqs = [freq_of.get(triple, 0.) for triple in lines]
+   elif weighted:
+      freqs = np.concatenate([table.freqs for table in tables]).tolist()
+   # Intern the set of all lines 
+   corpus = Corpus(lines, freqs)
+   # Get the mapping from the relevant overlap item to the rows containing it
+   line_dict = corpus.item_rows(overlap_item)
+   return corpus, line_dict
+
+
+def weighted_shuffle(rows, weights, numsample=None):
+   """Draw numsample (by default all) of the given rows by their weights (one per row of the corpus) with overlap.weighted_permutation
+
+   The draw is seeded by a single value from random, so it's seeded along with the rest of the split.
+   """
+   # Always take the value, even for no rows, so every weighted draw advances random the same way
+   rng = np.random.default_rng(random.getrandbits(64))
+   rows = np.asarray(rows, dtype=np.int64)
+   return rows[overlap.weighted_permutation(weights[rows], len(rows) if numsample is None else numsample, rng)].tolist()
+
+
+def subsample(corpus, triples, overlappable, numsample, overlap_ratio, overlap_item, weights=None):
+   """Helper function to sample our dev and test (as rows of the corpus) once we've sampled train
+
+   With weights (one per row of the corpus), the triples are drawn in proportion to their weights rather than uniformly.
+   """
 
    # Get the triples that contain or don't contain the given overlap item & shuffle them
-   overlaptriples = [triple for triple in triples if triple[overlap_item] in overlappable]
-   nonoverlaptriples = [triple for triple in triples if triple[overlap_item] not in overlappable]
-   random.shuffle(overlaptriples)
-   random.shuffle(nonoverlaptriples)
+   triples = np.asarray(triples, dtype=np.int64)
+   is_overlappable = np.isin(corpus.column(overlap_item)[triples], list(overlappable))
+   overlaptriples = triples[is_overlappable].tolist()
+   nonoverlaptriples = triples[~is_overlappable].tolist()
+   if weights is None:
+      random.shuffle(overlaptriples)
+      random.shuffle(nonoverlaptriples)
+   else:
+      overlaptriples = weighted_shuffle(overlaptriples, weights)
+      nonoverlaptriples = weighted_shuffle(nonoverlaptriples, weights)
 
-   # Get the number of overlappable and non-overlappable triples we want to sample 
-   num_overlappable = int(numsample * overlap_ratio)
-   num_nonoverlappable = numsample - num_overlappable
+   # Get the number of overlappable and non-overlappable triples we want to sample, as close to the requested ratio
+   # as the two pools allow, so that a small pool is made up for by the other one
+   num_overlappable, num_nonoverlappable = overlap.split_quotas(numsample, overlap_ratio, len(overlaptriples), len(nonoverlaptriples))
+   if num_overlappable != int(numsample * overlap_ratio):
+      print(f"\t\tMust oversample test. gap: {abs(num_overlappable - int(numsample * overlap_ratio))}")
 
    # Sample that many overlap triples & non-overlap triples 
    sampled = overlaptriples[:num_overlappable] + nonoverlaptriples[:num_nonoverlappable]
    remaining = overlaptriples[num_overlappable:] + nonoverlaptriples[num_nonoverlappable:]
-
-
-   # If enough triples aren't sampled, then increase the sample along the larger subset
-   if len(sampled) < numsample: 
-      gap = numsample - len(sampled)
-      print(f"\t\tMust oversample test. gap: {gap}")
-      # If there aren't enough non-overlappable triples, sample more of the overlappable ones 
-      if len(nonoverlaptriples) < num_nonoverlappable:
-         sampled = overlaptriples[:num_overlappable + gap] + nonoverlaptriples[:num_nonoverlappable]
-         remaining = overlaptriples[num_overlappable + gap:] + nonoverlaptriples[num_nonoverlappable:]
-      # If there aren't enough overlappable triples, sample more of the non-overlappable ones 
-      elif len(overlaptriples) < num_overlappable:
-         sampled = nonoverlaptriples[:num_overlappable + gap] + overlaptriples[:num_nonoverlappable]
-         remaining = nonoverlaptriples[num_overlappable + gap:] + overlaptriples[num_nonoverlappable:]
    return sampled, remaining
 
 
-def controlled_overlap_sample(line_dict, triples, trainsize, testsize, ftuneprop, overlap_item, overlap_ratio, start1):
-   """This function executes overlap-aware sampling"""
+def controlled_overlap_sample(corpus, line_dict, triples, trainsize, testsize, ftuneprop, overlap_item, overlap_ratio, start1, profiler=profiling.NULL, weights=None,
+   legacy_partition=False):
+   """This function executes overlap-aware sampling over the given rows of the corpus
+
+   With weights (one per row of the corpus), train & test are drawn in proportion to the weights of their triples.
+   With legacy_partition, the random draws of every partition the search skips are replayed, so the split for a seed
+   is the one the one-step growth loop made; this takes time in proportion to the triples of every skipped partition.
+   """
+   item_of = corpus.column(overlap_item).tolist()
    all_items = sorted(line_dict.keys())
    random.shuffle(triples)
    random.shuffle(all_items)
    partition = 1 if start1 else int(overlap_ratio * len(all_items))
    origpartition = partition
-
-   # Iteratively increase the partition until we can sample enough 
-   total_overlappable = 0
-   overlappable = {}
-   print("\t\tSampling train...")
-
-   # Iterate until we have sufficiently many triples with the overlap features
-   while total_overlappable < trainsize + overlap_ratio * testsize and len(overlappable) < len(all_items):
-      # Log if we needed to increase the partition for train
-      if partition == origpartition + 1:
-         print(f"\t\tMust oversample large train. Gap: {trainsize + overlap_ratio * testsize -len(overlaptriples)}")
-      # Get the items that are overlappable 
-      overlappable = set(all_items[:partition])
-      # Get the items that contain the overlappable items
-      overlaptriples = [triple for triple in triples if triple[overlap_item] in overlappable]
-      # Sample the training data as a subset of the triples with overlap 
-      random.shuffle(overlaptriples)
-      trainsample = overlaptriples[:trainsize]
-      # Now find how many triples have the relevant overlap item 
-      items_in_train = set(triple[overlap_item] for triple in trainsample)
-      total_overlappable = len([t for t in triples if t[overlap_item] in items_in_train])
-      partition += 1
+   target = trainsize + overlap_ratio * testsize
+
+   with profiler.phase("partition_search") as record:
+      # Get the positions of each item's triples in the shuffled corpus, so the overlappable triples can be grown item by item
+      item_positions = {}
+      for position, row in enumerate(triples):
+         item_positions.setdefault(item_of[row], []).append(position)
+      # Prefix sums over the shuffled items give the number of overlappable triples for every partition size
+      prefix_sizes = np.cumsum([0] + [len(item_positions.get(item, ())) for item in all_items])
+
+      # Iteratively increase the partition until we can sample enough
+      total_overlappable = 0
+      num_skipped = num_iterations = 0
+      num_overlappable = 0
+      print("\t\tSampling train...")
+
+      # A partition can only succeed once it has at least `target` overlappable triples, since the triples containing
+      # the items in train are a subset of these. Bisect to the first such partition & skip the ones before it; for
+      # legacy splits, replay their shuffles on placeholder lists so that the random state matches the one-step growth loop.
+      # If no partition is large enough, stop before the one with every item, which the growth loop still samples train from
+      feasible = max(partition, int(np.searchsorted(prefix_sizes, target, side="left")))
+      while partition < min(feasible, len(all_items)):
+         num_skipped += 1
+         if partition == origpartition + 1:
+            print(f"\t\tMust oversample large train. Gap: {target - prefix_sizes[min(origpartition, len(all_items))]}")
+         num_overlappable = min(partition, len(all_items))
+         if legacy_partition and weights is None:
+            random.shuffle([None] * int(prefix_sizes[num_overlappable]))
+         elif legacy_partition:
+            # A weighted draw takes a single value from random
+            random.getrandbits(64)
+         partition += 1
+
+      # Iterate until we have sufficiently many triples with the overlap features
+      positions = []
+      num_added = 0
+      while total_overlappable < target and num_overlappable < len(all_items):
+         num_iterations += 1
+         # Log if we needed to increase the partition for train
+         if partition == origpartition + 1:
+            print(f"\t\tMust oversample large train. Gap: {target - prefix_sizes[min(origpartition, len(all_items))]}")
+         # Add the positions of the triples containing the newly overlappable items, keeping them in corpus order
+         num_overlappable = min(partition, len(all_items))
+         new_positions = sorted(p for item in all_items[num_added:num_overlappable] for p in item_positions.get(item, ()))
+         positions = list(heapq.merge(positions, new_positions))
+         num_added = num_overlappable
+         # Sample the training data as a subset of the triples with overlap
+         overlaptriples = [triples[p] for p in positions]
+         if weights is None:
+            random.shuffle(overlaptriples)
+            trainsample = overlaptriples[:trainsize]
+         else:
+            trainsample = weighted_shuffle(overlaptriples, weights, trainsize)
+         # Now find how many triples have the relevant overlap item
+         items_in_train = set(item_of[row] for row in trainsample)
+         total_overlappable = sum(len(item_positions[item]) for item in items_in_train)
+         partition += 1
+      # Each iteration samples train again; the partitions skipped by bisecting only replay their shuffles (if legacy)
+      record.update(partition_skipped=num_skipped, partition_replayed=num_skipped if legacy_partition else 0, partition_iterations=num_iterations, partition_size=num_overlappable, overlappable_triples=len(positions))
 
    # Get all the remaining items 
-   remaining = sorted(set(triples).difference(trainsample))
+   remaining = np.setdiff1d(triples, trainsample).tolist()
 
    # Split the training data into train & finetune
    random.shuffle(trainsample)
@@ -148,56 +196,381 @@ def controlled_overlap_sample(line_dict, triples, trainsize, testsize, ftuneprop
    print("\t\tTrain sampled. Sampling test...")
 
 
-   test, remaining = subsample(line_dict, remaining, items_in_train, testsize, overlap_ratio, overlap_item)
+   with profiler.phase("subsample", test=testsize):
+      test, remaining = subsample(corpus, remaining, items_in_train, testsize, overlap_ratio, overlap_item, weights)
    print("\t\tTest sampled.")
 
    return train, ftune, test 
 
 
 
-def main(train_path, gold_path, trainsize, testsize, overlap_item, overlap_ratio, ftuneprop, seed, outdir, start1):
-   """The main function to execute the splitting"""
-   print(f"Training size: {trainsize} (ftune subset: {ftuneprop*trainsize}), test size: {testsize}. Seed = {seed}")
-   # Set the random seed for replicability 
-   random.seed(seed)
-   # Create the output directory if it doesn't already exist 
-   if not os.path.exists(f"{outdir}/{seed}"):
-      os.makedirs(f"{outdir}/{seed}")
+def joint_overlap_sample(corpus, triples, trainsize, testsize, ftuneprop, lemma_ratio, feat_ratio, profiler=profiling.NULL, weights=None):
+   """This function executes overlap-aware sampling over the given rows of the corpus, controlling lemma & feature overlap at once
+
+   With weights (one per row of the corpus), train & test are drawn in proportion to the weights of their triples.
+   """
+   lemmas, feats = corpus.column(LEMMA), corpus.column(FEATS)
+   num_lemmas, num_feats = len(corpus.vocab[LEMMA]), len(corpus.vocab[FEATS])
+   random.shuffle(triples)
+   rows = np.asarray(triples, dtype=np.int64)
+   # Rank every lemma & feature set in a random order; the overlappable items are a prefix of each order
+   lemma_rank = np.empty(num_lemmas, dtype=np.int64)
+   lemma_rank[random.sample(range(num_lemmas), num_lemmas)] = np.arange(num_lemmas)
+   feat_rank = np.empty(num_feats, dtype=np.int64)
+   feat_rank[random.sample(range(num_feats), num_feats)] = np.arange(num_feats)
+   row_lemma_rank = lemma_rank[lemmas[rows]]
+   row_feat_rank = feat_rank[feats[rows]]
+
+   with profiler.phase("partition_search") as record:
+      # Grow both partitions in step from their ratios, bisecting on the step for the smallest one whose
+      # triples (with both an overlappable lemma & an overlappable feature set) can fill train & the overlap of test
+      start_lemmas, start_feats = int(lemma_ratio * num_lemmas), int(feat_ratio * num_feats)
+      num_steps = max(num_lemmas - start_lemmas, num_feats - start_feats, 1)
+      def eligible(step):
+         partition_lemmas = start_lemmas + -(-step * (num_lemmas - start_lemmas) // num_steps)
+         partition_feats = start_feats + -(-step * (num_feats - start_feats) // num_steps)
+         return (row_lemma_rank < partition_lemmas) & (row_feat_rank < partition_feats)
+      target = trainsize + max(lemma_ratio, feat_ratio) * testsize
+      low, high = 0, num_steps
+      num_iterations = 0
+      while low < high:
+         num_iterations += 1
+         middle = (low + high) // 2
+         if np.count_nonzero(eligible(middle)) >= target:
+            high = middle
+         else:
+            low = middle + 1
+      if low > 0:
+         print(f"\t\tMust oversample large train. Partition grown by {low} of {num_steps} steps")
+      record.update(partition_iterations=num_iterations, partition_steps=low)
+
+   # The rows are shuffled, so the first eligible ones are a random sample of them
+   print("\t\tSampling train...")
+   if weights is None:
+      trainsample = rows[eligible(low)][:trainsize].tolist()
+   else:
+      trainsample = weighted_shuffle(rows[eligible(low)], weights, trainsize)
+   random.shuffle(trainsample)
+   cutoff = int(ftuneprop * trainsize)
+   train = trainsample[cutoff:]
+   ftune = trainsample[:cutoff]
+
+   print("\t\tTrain sampled. Sampling test...")
+   with profiler.phase("subsample", test=testsize):
+      # Split the remaining triples by whether their lemma & feature set are seen in train
+      lemma_seen = np.zeros(num_lemmas, dtype=bool)
+      lemma_seen[lemmas[trainsample]] = True
+      feat_seen = np.zeros(num_feats, dtype=bool)
+      feat_seen[feats[trainsample]] = True
+      remaining = np.setdiff1d(rows, trainsample)
+      remaining_lemma_seen, remaining_feat_seen = lemma_seen[lemmas[remaining]], feat_seen[feats[remaining]]
+      pools = [remaining[remaining_lemma_seen & remaining_feat_seen].tolist(), remaining[remaining_lemma_seen & ~remaining_feat_seen].tolist(),
+         remaining[~remaining_lemma_seen & remaining_feat_seen].tolist(), remaining[~remaining_lemma_seen & ~remaining_feat_seen].tolist()]
+      quotas = overlap.joint_quotas(testsize, lemma_ratio, feat_ratio, [len(pool) for pool in pools])
+      test = []
+      for pool, quota in zip(pools, quotas):
+         if weights is None:
+            random.shuffle(pool)
+            test += pool[:quota]
+         else:
+            test += weighted_shuffle(pool, weights, quota)
+   print("\t\tTest sampled.")
+
+   return train, ftune, test
+
+
+def partition_items(line_dict, k):
+   """Shuffle the items of line_dict & deal them into k disjoint groups holding as near equal numbers of triples as possible, returning the group of each item"""
+   items = sorted(line_dict.keys())
+   random.shuffle(items)
+   # Deal the largest items first, each to the group with the fewest triples so far, so every group gets a share of
+   # the frequent & the rare items; the shuffle breaks ties between items of the same size
+   items.sort(key=lambda item: -len(line_dict[item]))
+   group_of = np.empty(len(items), dtype=np.int64)
+   groups = [(0, n) for n in range(k)]
+   for item in items:
+      size, n = heapq.heappop(groups)
+      group_of[item] = n
+      heapq.heappush(groups, (size + len(line_dict[item]), n))
+   return group_of
+
+
+def kfold_sample(corpus, line_dict, triples, k, trainsize, testsize, ftuneprop, overlap_item, overlap_ratio, profiler=profiling.NULL, weights=None):
+   """Partition the overlap items into k disjoint groups once & derive k overlap-controlled (train, ftune, test) folds from it
+
+   Fold n holds out the items of group n: train & ftune are drawn from the rows of the other groups, the overlapping
+   part of test from the rest of those rows whose item made it into train, and the rest of test from the held-out
+   group. The rows are shuffled once & shared by every fold, so no fold is sampled on its own. A fold is None if the
+   other groups don't hold enough triples for train. With weights (one per row of the corpus), the shared order is a
+   weighted draw of all the rows, and so every fold's part of it is a weighted draw of that part.
+   """
+   with profiler.phase("partition", folds=k) as record:
+      if weights is None:
+         random.shuffle(triples)
+      else:
+         triples = weighted_shuffle(triples, weights)
+      rows = np.asarray(triples, dtype=np.int64)
+      items = corpus.column(overlap_item)
+      row_groups = partition_items(line_dict, k)[items[rows]]
+      record.update(group_triples=np.bincount(row_groups, minlength=k).tolist())
+   cutoff = int(ftuneprop * trainsize)
+   folds = []
+   for n in range(k):
+      held_out = row_groups == n
+      pool = rows[~held_out]
+      if len(pool) < trainsize:
+         print(f"\t\tFold {n}: only {len(pool)} triples outside the held-out items, too few for train")
+         folds.append(None)
+         continue
+      trainsample = pool[:trainsize]
+      seen = np.zeros(len(line_dict), dtype=bool)
+      seen[items[trainsample]] = True
+      rest = pool[trainsize:]
+      rest_seen = seen[items[rest]]
+      # Fill the non-overlapping part of test from the held-out group first
+      overlaptriples = rest[rest_seen]
+      nonoverlaptriples = np.concatenate([rows[held_out], rest[~rest_seen]])
+      num_overlappable, num_nonoverlappable = overlap.split_quotas(testsize, overlap_ratio, len(overlaptriples), len(nonoverlaptriples))
+      if num_overlappable != int(testsize * overlap_ratio):
+         print(f"\t\tFold {n}: must oversample test. gap: {abs(num_overlappable - int(testsize * overlap_ratio))}")
+      test = overlaptriples[:num_overlappable].tolist() + nonoverlaptriples[:num_nonoverlappable].tolist()
+      folds.append((trainsample[cutoff:].tolist(), trainsample[:cutoff].tolist(), test))
+   return folds
+
+
+def sampling_weights(corpus):
+   """Get the weights to sample the rows of the corpus by: their frequencies if it was read with them & any triple has one, otherwise None to sample uniformly"""
+   if corpus.freqs is None:
+      return None
+   if not np.any(corpus.freqs > 0):
+      # Sample exactly as an unweighted run would, so the split for a seed is the same
+      print("\t\tNo triple has a frequency; sampling uniformly")
+      return None
+   print(f"\t\tSampling by frequency ({np.count_nonzero(corpus.freqs > 0)} of {len(corpus)} triples have one)")
+   return corpus.freqs
+
+
+def split_corpus(corpus, line_dict, family, lang, trainsize, testsize, overlap_item, overlap_ratio, ftuneprop, seed, outdir, start1, feat_overlap_ratio=None, compression=None, profiler=profiling.NULL,
+   legacy_partition=False):
+   """Split a single language that's already been read in & write out the result, returning the log, the statistics for the summary & the files written"""
+   log = io.StringIO()
+   with contextlib.redirect_stdout(log):
+      # Seed from the language as well as the seed so the split doesn't depend on which languages were split before it
+      random.seed(f"{seed}/{family}/{lang}")
+      # Only attempt sampling if it's at least big enough 
+      if len(corpus) < trainsize + testsize:
+         return log.getvalue(), None, []
+      print(f"\tSplitting {lang} ({len(corpus)} triples)...")
+      sizes = np.asarray([len(v) for v in line_dict.values()])
+      print(f"\t\tMean size: {np.mean(sizes) :.3f} (stdev: {np.std(sizes) :.3f}, n: {len(sizes)})")
+      weights = sampling_weights(corpus)
+      # Sample from a fresh list of rows, since sampling shuffles them in place & the corpus may be reused
+      if overlap_item == BOTH:
+         # The overlap ratio controls the lemmas, and the lemmas are reported as the overlap item
+         train, ftune, test = joint_overlap_sample(corpus, list(range(len(corpus))), trainsize, testsize, ftuneprop, overlap_ratio, feat_overlap_ratio, profiler, weights)
+      else:
+         train, ftune, test = controlled_overlap_sample(corpus, line_dict, list(range(len(corpus))), trainsize, testsize, ftuneprop, overlap_item, overlap_ratio, start1, profiler, weights, legacy_partition)
+      reported_item = LEMMA if overlap_item == BOTH else overlap_item
+      number_unique = len(np.unique(corpus.column(reported_item)[train]))
+      with profiler.phase("validate", train=len(train), ftune=len(ftune), test=len(test)):
+         test_overlap, ft_overlap = validate(corpus, train, ftune, test, reported_item, printoverlap=True)
+      # Only write out the result if we achieve the desired overlap; otherwise the user is warned in the summary
+      written = []
+      if test_overlap >= overlap_ratio:
+         print(f"\t\tWriting splits to {outdir}")
+         with profiler.phase("write", files=3):
+            written = write_splits(outdir, family.lower(), lang, seed, corpus.decode(train), corpus.decode(ftune), corpus.decode(test), compression)
+   return log.getvalue(), (test_overlap, ft_overlap, number_unique), written
+
+
+def split_corpus_folds(corpus, line_dict, family, lang, trainsize, testsize, overlap_item, overlap_ratio, ftuneprop, seed, outdir, folds, compression=None, profiler=profiling.NULL):
+   """Split a single language that's already been read in into k folds & write out each one under outdir/fold<n>
+
+   Returns the log of the language as a whole (from before the folds were split up), and the log, the statistics for
+   the summary & the files written of every fold, as split_corpus does for a single split.
+   """
+   header = io.StringIO()
+   results = []
+   with contextlib.redirect_stdout(header):
+      random.seed(f"{seed}/{family}/{lang}")
+      if len(corpus) < trainsize + testsize:
+         return header.getvalue(), [("", None, [])] * folds
+      print(f"\tSplitting {lang} ({len(corpus)} triples) into {folds} folds...")
+      sizes = np.asarray([len(v) for v in line_dict.values()])
+      print(f"\t\tMean size: {np.mean(sizes) :.3f} (stdev: {np.std(sizes) :.3f}, n: {len(sizes)})")
+      samples = kfold_sample(corpus, line_dict, list(range(len(corpus))), folds, trainsize, testsize, ftuneprop, overlap_item, overlap_ratio, profiler, sampling_weights(corpus))
+   for n, sample in enumerate(samples):
+      # Each fold's log only holds what was printed while splitting it
+      log = io.StringIO()
+      with contextlib.redirect_stdout(log):
+         if sample is None:
+            results.append((log.getvalue(), None, []))
+         else:
+            train, ftune, test = sample
+            number_unique = len(np.unique(corpus.column(overlap_item)[train]))
+            fold_profiler = profiler.child(fold=n)
+            with fold_profiler.phase("validate", train=len(train), ftune=len(ftune), test=len(test)):
+               test_overlap, ft_overlap = validate(corpus, train, ftune, test, overlap_item, printoverlap=True)
+            written = []
+            if test_overlap >= overlap_ratio:
+               print(f"\t\tWriting splits to {outdir}/fold{n}")
+               with fold_profiler.phase("write", files=3):
+                  written = write_splits(f"{outdir}/fold{n}", family.lower(), lang, seed, corpus.decode(train), corpus.decode(ftune), corpus.decode(test), compression)
+            results.append((log.getvalue(), (test_overlap, ft_overlap, number_unique), written))
+   overlaps = [result[0] for _, result, _ in results if result is not None]
+   if overlaps:
+      last_log, result, written = results[-1]
+      results[-1] = (last_log + f"\t\tTest overlap across {len(overlaps)} folds: {np.mean(overlaps) :.3f} (stdev: {np.std(overlaps) :.3f})\n", result, written)
+   return header.getvalue(), results
+
+
+def split_language(train_path, gold_path, family, lang, trainsize, testsize, overlap_item, overlap_ratios, ftuneprop, seeds, outdir, start1, cache_dir=None, feat_overlap_ratio=None, compression=None, force=False, profile=False,
+   folds=None, weighted=False, freq_path=None, legacy_partition=False):
+   """Read in a single language once & split it for every seed & overlap ratio, returning the header, the log, the statistics & the manifest update of each split
+
+   Splits whose manifest shows they were made from the same inputs & parameters are skipped (unless forced), and the
+   language is only read in if at least one split needs making. The manifest updates are (directory, language, entry)
+   for the caller to record, or None for skipped splits. The profile records of the language (if profiling) are returned alongside.
+   With folds, every seed & overlap ratio gives that many folds (in fold order) instead of a single split, and the log
+   of splitting the language into them is the header of the first fold (the header is empty otherwise). If weighted,
+   the triples are sampled by their frequency, read from <freq_path>/<lang>.freq if given (see read_corpus). With
+   legacy_partition, the train partition search reproduces the splits made before it skipped partitions without replaying them.
+   """
+   profiler = profiling.Profiler(family=family, language=lang) if profile else profiling.NULL
+   input_paths = [f"{train_path}/{family}/{lang}.trn", f"{train_path}/{family}/{lang}.dev", f"{gold_path}/{lang}.tst"]
+   freq_file = f"{freq_path}/{lang}.freq" if weighted and freq_path is not None else None
+   if freq_file is not None:
+      input_paths.append(freq_file)
+   inputs = manifest.file_hashes(input_paths)
+   corpus = None
+   results = []
+   for overlap_ratio in overlap_ratios:
+      # Only nest the output by overlap ratio if we're sweeping over more than one
+      ratio_outdir = outdir if len(overlap_ratios) == 1 else f"{outdir}/{overlap_ratio}"
+      for seed in seeds:
+         # The folds of a seed all come from one partition, so they're made (or skipped) together
+         directories = [f"{ratio_outdir}/{seed}/{family.lower()}"] if folds is None else [f"{ratio_outdir}/fold{n}/{seed}/{family.lower()}" for n in range(folds)]
+         params = {"trainsize": trainsize, "testsize": testsize, "overlap_item": overlap_item, "overlap_ratio": overlap_ratio, "feat_overlap_ratio": feat_overlap_ratio,
+            "ftuneprop": ftuneprop, "seed": seed, "start1": start1, "compression": compression}
+         if folds is not None:
+            params["folds"] = folds
+         if weighted:
+            params["weighted"] = True
+         if legacy_partition:
+            params["legacy_partition"] = True
+         entries = [manifest.read_manifest(directory).get(lang) for directory in directories]
+         if not force and all(manifest.up_to_date(entry, SPLIT_VERSION, inputs, params, directory) for entry, directory in zip(entries, directories)):
+            for entry in entries:
+               result = entry["result"]
+               results.append(("", f"\tSkipping {lang}: its splits are up to date\n", tuple(result) if result is not None else None, None))
+            continue
+         if corpus is None:
+            with profiler.phase("read") as record:
+               corpus, line_dict = read_corpus(f"{train_path}/{family}/{lang}", f"{gold_path}/{lang}", LEMMA if overlap_item == BOTH else overlap_item, cache_dir, weighted, freq_file)
+               record.update(triples=len(corpus), items=len(line_dict))
+         header = ""
+         if folds is None:
+            splits = [split_corpus(corpus, line_dict, family, lang, trainsize, testsize, overlap_item, overlap_ratio, ftuneprop, seed, ratio_outdir, start1,
+               feat_overlap_ratio=feat_overlap_ratio, compression=compression, profiler=profiler.child(overlap_ratio=overlap_ratio, seed=seed), legacy_partition=legacy_partition)]
+         else:
+            header, splits = split_corpus_folds(corpus, line_dict, family, lang, trainsize, testsize, overlap_item, overlap_ratio, ftuneprop, seed, ratio_outdir, folds,
+               compression=compression, profiler=profiler.child(overlap_ratio=overlap_ratio, seed=seed))
+         for n, (directory, (log, result, written)) in enumerate(zip(directories, splits)):
+            results.append((header if n == 0 else "", log, result, (directory, lang, manifest.make_entry(SPLIT_VERSION, inputs, params, directory, written, result))))
+   return results, list(profiler.records)
+
+
+def _split_language_task(task):
+   """Call split_language with the keyword arguments of a task in a worker process"""
+   return split_language(**task)
+
+
+def describe(key):
+   """Describe the (overlap ratio, seed) or (overlap ratio, seed, fold) key of the splits of a sweep"""
+   return ", ".join(f"{name} {value}" for name, value in zip(("overlap ratio", "seed", "fold"), key))
+
+
+def summarize(overlap_ratio, results):
+   """Print the summary statistics from the (language, result) pairs of a single seed & overlap ratio"""
    # Store languages which don't achieve the overlap ratio
    languages_with_lower_overlap = []
    feature_overlaps = []
    numbers_unique = []
-   # Consider languages family-by-family 
-   for family in [f for f in os.listdir(train_path) if "." not in f]:
-      print(f"Splitting {family} family...")
-      for lang in set([l.strip().split(".")[0] for l in os.listdir(f"{train_path}/{family}")]):
-         # Read in the corpus
-         lines, line_dict = read_corpus(f"{train_path}/{family}/{lang}", f"{gold_path}/{lang}", overlap_item)
-         # Only attempt sampling if it's at least big enough 
-         if len(lines) >= trainsize + testsize:
-            print(f"\tSplitting {lang} ({len(lines)} triples)...")
-            sizes = np.asarray([len(v) for v in line_dict.values()])
-            print(f"\t\tMean size: {np.mean(sizes) :.3f} (stdev: {np.std(sizes) :.3f}, n: {len(sizes)})")
-            train, ftune, test = controlled_overlap_sample(line_dict, lines, trainsize, testsize, ftuneprop, overlap_item, overlap_ratio, start1)
-            number_unique = set([x[overlap_item] for x in train])
-            numbers_unique.append(len(number_unique)) 
-            test_overlap, ft_overlap = validate(train, ftune, test, overlap_item, printoverlap=True)
-            # If we achieve the desired overlap, write out the result. Otherwise, warn the user
-            if test_overlap < overlap_ratio:
-               languages_with_lower_overlap.append((lang, test_overlap))
-            else:
-               feature_overlaps.append(ft_overlap)
-               print(f"\t\tWriting splits to {outdir}")
-               write_splits(outdir, family.lower(), lang, seed, train, ftune, test)
+   for lang, result in results:
+      if result is None:
+         continue
+      test_overlap, ft_overlap, number_unique = result
+      numbers_unique.append(number_unique)
+      if test_overlap < overlap_ratio:
+         languages_with_lower_overlap.append((lang, test_overlap))
+      else:
+         feature_overlaps.append(ft_overlap)
    print(f"Finished splitting. The following languages didn't reach {overlap_ratio} overlap:")
    for language, overlap in languages_with_lower_overlap:
       print(f"\t{language} ({overlap} overlap)")
    feature_overlaps = np.asarray(feature_overlaps)
    print(f"Mean feature overlap: {np.mean(feature_overlaps) :.3f} (stdev: {np.std(feature_overlaps) :.3f})")
    print(f"Mean overlap items in train: {np.mean(numbers_unique) :.3f} (stdev: {np.std(numbers_unique) :.3f})")
+
+
+def sweep(train_path, gold_path, trainsize, testsize, overlap_item, overlap_ratios, ftuneprop, seeds, outdir, start1, jobs=1, cache_dir=None, feat_overlap_ratio=None, compression=None, force=False, profile=False,
+   folds=None, weighted=False, freq_path=None, legacy_partition=False):
+   """Split every language for every seed & overlap ratio, reading each corpus only once
+
+   If profiling, the time, memory & item counts of every phase of every language are appended to profile.jsonl in
+   outdir, like make_splits does, so a re-run that skips up-to-date languages keeps the records of the earlier runs.
+   With folds, every seed & overlap ratio gives that many cross-validation folds, each written under fold<n>.
+   If weighted, the triples are sampled by their frequency, from <freq_path>/<lang>.freq if given & otherwise from
+   the 4th column of the input files. With legacy_partition, lemma & feature splits are the ones made before the train
+   partition search stopped replaying the random draws of the partitions it skips, at the cost of that replay.
+   """
+   if folds is not None and (folds < 2 or overlap_item == BOTH):
+      raise Exception("Folds need at least 2 folds & a single overlap item (LEMMA or FEATS)")
+   print(f"Training size: {trainsize} (ftune subset: {ftuneprop*trainsize}), test size: {testsize}. Seeds = {seeds}, overlap ratios = {overlap_ratios}")
+   # The arguments of split_language shared by every language, passed by name so none can get out of step
+   options = dict(train_path=train_path, gold_path=gold_path, trainsize=trainsize, testsize=testsize, overlap_item=overlap_item, overlap_ratios=overlap_ratios, ftuneprop=ftuneprop,
+      seeds=seeds, outdir=outdir, start1=start1, cache_dir=cache_dir, feat_overlap_ratio=feat_overlap_ratio, compression=compression, force=force, profile=profile, folds=folds,
+      weighted=weighted, freq_path=freq_path, legacy_partition=legacy_partition)
+   # Consider languages family-by-family; each language gets its own random seed, so they can be split in any order
+   tasks = []
+   for family in sorted(f for f in os.listdir(train_path) if "." not in f):
+      for lang in sorted(set([l.strip().split(".")[0] for l in os.listdir(f"{train_path}/{family}")])):
+         tasks.append(dict(options, family=family, lang=lang))
+   # Gather the results in task order so the log & summary are the same whatever the number of jobs
+   results = {(overlap_ratio, seed) + fold: [] for overlap_ratio in overlap_ratios for seed in seeds for fold in ([()] if folds is None else [(n,) for n in range(folds)])}
+   if profile:
+      os.makedirs(outdir, exist_ok=True)
+   with multiprocessing.Pool(jobs) if jobs > 1 else contextlib.nullcontext() as pool, open(f"{outdir}/profile.jsonl", "a") if profile else contextlib.nullcontext() as profile_file:
+      family = None
+      for task, (language_results, records) in zip(tasks, pool.imap(_split_language_task, tasks) if jobs > 1 else map(_split_language_task, tasks)):
+         if task["family"] != family:
+            family = task["family"]
+            print(f"Splitting {family} family...")
+         for key, (header, log, result, update) in zip(results, language_results):
+            print(header, end="")
+            if len(results) > 1:
+               print(f"\t[{describe(key)}]")
+            print(log, end="")
+            # Only this process writes the manifests, so languages split in parallel can't clobber each other's entries
+            if update is not None:
+               manifest.update_manifest(*update)
+            results[key].append((task["lang"], result))
+         if profile:
+            profiling.write_records(profile_file, records)
+   for key, ratio_results in results.items():
+      if len(results) > 1:
+         print(f"{describe(key).capitalize()}:")
+      summarize(key[0], ratio_results)
    print("Done.")
 
 
+def main(train_path, gold_path, trainsize, testsize, overlap_item, overlap_ratio, ftuneprop, seed, outdir, start1, jobs=1, cache_dir=None, feat_overlap_ratio=None, compression=None, force=False, profile=False,
+   folds=None, weighted=False, freq_path=None, legacy_partition=False):
+   """The main function to execute the splitting"""
+   sweep(train_path, gold_path, trainsize, testsize, overlap_item, [overlap_ratio], ftuneprop, [seed], outdir, start1, jobs=jobs, cache_dir=cache_dir, feat_overlap_ratio=feat_overlap_ratio,
+      compression=compression, force=force, profile=profile, folds=folds, weighted=weighted, freq_path=freq_path, legacy_partition=legacy_partition)
+
+
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Make train / dev / test split with controlled overlap")
@@ -210,10 +583,22 @@ if __name__ == "__main__":
 
     # Optional arguments that we have reasonable defaults for 
     parser.add_argument("--overlap_ratio", help = "The maximum ratio of overlap", type = float, default = 0.5)
-    parser.add_argument("--overlap_item",  help = "The item whose overlap should be controlled", default="LEMMA")
+    parser.add_argument("--overlap_item",  help = "The item whose overlap should be controlled (LEMMA, FEATS, or BOTH)", default="LEMMA")
+    parser.add_argument("--feat_overlap_ratio", help = "With --overlap_item BOTH, the ratio of feature overlap (the overlap ratio is then the lemma overlap)", type = float)
     parser.add_argument("--ftune_prop", help = "The proportion of items in train to be subsampled for ftune", type=float, default = 0.125)
     parser.add_argument("--seed", help = "The random seed", type = int, default = 1)
     parser.add_argument('--start1', action=argparse.BooleanOptionalAction, default = False)
+    parser.add_argument("--seeds", help = "Sweep over these random seeds, reading each language only once", type = int, nargs = "+")
+    parser.add_argument("--overlap_ratios", help = "Sweep over these overlap ratios, reading each language only once", type = float, nargs = "+")
+    parser.add_argument("--cache_dir", help = "Cache the parsed input files in this directory so later runs can skip parsing")
+    parser.add_argument("--jobs", help = "The number of languages to split in parallel", type = int, default = 1)
+    parser.add_argument("--compress", help = "Compress the written splits", choices = list(SUFFIXES))
+    parser.add_argument("--force", help = "Split every language again, even if its manifest shows its splits are up to date", action = "store_true")
+    parser.add_argument("--profile", help = "Append the time, memory & item counts of every phase of every language to profile.jsonl in the output directory", action = "store_true")
+    parser.add_argument("--folds", help = "Partition the overlap items into this many groups & write one cross-validation fold per group under fold<n>", type = int)
+    parser.add_argument("--weighted", help = "Sample triples in proportion to their frequency, from a 4th column of the input files or from --freq_data", action = "store_true")
+    parser.add_argument("--legacy_partition", help = "Replay the random draws of every train partition the search skips, reproducing splits made before it skipped them (slow for large languages)", action = "store_true")
+    parser.add_argument("--freq_data", help = "With --weighted, the directory of <lang>.freq files (UniMorph with a 4th frequency column) to take the frequencies from")
     args = parser.parse_args()
 
     # Parse the arguments and call the main function
@@ -223,18 +608,56 @@ if __name__ == "__main__":
     elif args.overlap_item.strip().upper() == "FEATS":
       print("Splitting to control feature overlap")
       overlap_item = FEATS
+    elif args.overlap_item.strip().upper() == "BOTH":
+      print("Splitting to control lemma & feature overlap")
+      overlap_item = BOTH
+      if args.feat_overlap_ratio is None:
+        raise Exception("Controlling both overlaps needs a --feat_overlap_ratio")
     else:
       raise Exception("Overlap must be either lemma or features")
-    main(args.train_data, 
-      args.gold_data, 
-      args.train_size, 
-      args.test_size, 
-      overlap_item, 
-      args.overlap_ratio, 
-      args.ftune_prop,
-      args.seed,
-      args.outdir,
-      args.start1
-      )
+    if args.seeds or args.overlap_ratios:
+      sweep(args.train_data,
+         args.gold_data,
+         args.train_size,
+         args.test_size,
+         overlap_item,
+         args.overlap_ratios or [args.overlap_ratio],
+         args.ftune_prop,
+         args.seeds or [args.seed],
+         args.outdir,
+         args.start1,
+         jobs=args.jobs,
+         cache_dir=args.cache_dir,
+         feat_overlap_ratio=args.feat_overlap_ratio,
+         compression=args.compress,
+         force=args.force,
+         profile=args.profile,
+         folds=args.folds,
+         weighted=args.weighted,
+         freq_path=args.freq_data,
+         legacy_partition=args.legacy_partition
+         )
+    else:
+      main(args.train_data, 
+         args.gold_data, 
+         args.train_size, 
+         args.test_size, 
+         overlap_item, 
+         args.overlap_ratio, 
+         args.ftune_prop,
+         args.seed,
+         args.outdir,
+         args.start1,
+         jobs=args.jobs,
+         cache_dir=args.cache_dir,
+         feat_overlap_ratio=args.feat_overlap_ratio,
+         compression=args.compress,
+         force=args.force,
+         profile=args.profile,
+         folds=args.folds,
+         weighted=args.weighted,
+         freq_path=args.freq_data,
+         legacy_partition=args.legacy_partition
+         )
 
 
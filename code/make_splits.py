@@ -1,154 +1,113 @@
 import sys, os, argparse, random
 from math import ceil
+import numpy as np
 from numpy.random import choice, seed
-from collections import defaultdict
+import overlap, manifest, profiling
+from corpus import Corpus, read_unimorph, write_rows, SUFFIXES
 
 LEMMA = 0
 FEATS = 2
 INFL = 1
 FREQ = 3
+# Bump whenever a change to the sampling changes the splits made from the same inputs & parameters
+SPLIT_VERSION = 2
 
 def set_seed(randomseed):
     random.seed(randomseed) #random seed
     seed(sum([ord(c) for c in randomseed])) #numpy random seed
 
 
-def readcorpus(infname):
-    feats_to_triples = defaultdict(lambda: set)
-    triples = set([])
-    triples_to_freqs = {}
+def readcorpus(infname, cache_dir=None):
+    # Returns the corpus (see corpus.Corpus) & the row of each of its triples in file order
+    triples = []
+    freqs = []
     seenlemmafeats = set([]) # Remove duplicate lemma, feature pairs that can exist in UniMorph. Very confusing.
-    with open(infname, "r") as fin:
-        for line in fin:
-            if not line.strip():
-                continue
-            lemma = ""
-            infl = ""
-            feats = ""
-            freq = 0
-            try:
-                lemma, infl, feats, freq = line.strip().split("\t")
-            except ValueError:
-                lemma, infl, feats = line.strip().split("\t")
-            if (lemma, feats) in seenlemmafeats:
-                continue
-            seenlemmafeats.add((lemma, feats))
-            freq = float(freq)
-            triples_to_freqs[(lemma, infl, feats)] = freq
-            feats_to_triples[feats] = (lemma, infl, feats)
-            triples.add((lemma, infl, feats))
-    indices_to_triples = {i:triple for i, triple in enumerate(triples_to_freqs)}
-    return sorted(triples), triples_to_freqs, feats_to_triples, indices_to_triples
-
-
-def writesample(sample, showinfl, outdir, fname):
-    outfname = os.path.join(outdir, fname)
-    cutoff = 3
-    if not showinfl:
-        cutoff = 2
-    with open(outfname, "w") as fout:
-        for s in sample:
-            if showinfl:
-                fout.write("%s\n" % "\t".join(s))
-            else:
-                fout.write("%s\t%s\n" % (s[LEMMA], s[FEATS]))
-
-
-def writesamples(outdir, language, seed, ltrain, lftune, dev, test, strain, sftune):
-    writesample(strain, True, outdir,  "%s_%s_small.train" % (language, seed))
-    writesample(ltrain, True, outdir, "%s_%s_large.train" % (language, seed))
-    writesample(sftune, True, outdir,  "%s_%s_small.ftune" % (language, seed))
-    writesample(lftune, True, outdir, "%s_%s_large.ftune" % (language, seed))
-    writesample(test, False, outdir, "%s_%s.test" % (language, seed))
-    writesample(test, True, outdir, "%s_%s.gold" % (language, seed))
-    writesample(dev, True, outdir,  "%s_%s.dev" % (language, seed))
+    table = read_unimorph(infname, cache_dir) # frequency is 0 for 3-column files
+    for (lemma, infl, feats), freq in zip(table.triples(), table.freqs.tolist()):
+        if (lemma, feats) in seenlemmafeats:
+            continue
+        seenlemmafeats.add((lemma, feats))
+        triples.append((lemma, infl, feats))
+        freqs.append(freq)
+    # The triples are distinct once deduplicated, so the corpus keeps one row (& its frequency) for each, in sorted order
+    corpus = Corpus(triples, freqs)
+    order = np.empty(len(triples), dtype=np.int64)
+    order[sorted(range(len(triples)), key=triples.__getitem__)] = np.arange(len(triples))
+    return corpus, order
+
+
+def writesample(corpus, sample, showinfl, outdir, fname, compression=None):
+    # Each file is written in one go & renamed into place, so re-runs replace it. The sample holds rows of the corpus
+    sample = corpus.decode(sample)
+    if showinfl:
+        rows = sample
+    else:
+        rows = [(s[LEMMA], s[FEATS]) for s in sample]
+    return write_rows(os.path.join(outdir, fname), rows, compression)
+
+
+def writesamples(corpus, outdir, language, seed, ltrain, lftune, dev, test, strain, sftune, compression=None):
+    return [writesample(corpus, strain, True, outdir,  "%s_%s_small.train" % (language, seed), compression),
+        writesample(corpus, ltrain, True, outdir, "%s_%s_large.train" % (language, seed), compression),
+        writesample(corpus, sftune, True, outdir,  "%s_%s_small.ftune" % (language, seed), compression),
+        writesample(corpus, lftune, True, outdir, "%s_%s_large.ftune" % (language, seed), compression),
+        # The test file holds the inputs only & the gold file the full test triples
+        writesample(corpus, test, False, outdir, "%s_%s.test" % (language, seed), compression),
+        writesample(corpus, test, True, outdir, "%s_%s.gold" % (language, seed), compression),
+        writesample(corpus, dev, True, outdir,  "%s_%s.dev" % (language, seed), compression)]
 
 
 def compute_overlap(train, test, i=FEATS, printoverlap=False):
-    trainitems = [triple[i] for triple in train]
-    testitems = [triple[i] for triple in test]
-    numtestoverlap = 0
-    numtrainoverlap = 0
-    for item in testitems:
-        if item in trainitems:
-            numtestoverlap += 1
-    for item in trainitems:
-        if item in testitems:
-            numtrainoverlap += 1
+    trainoverlap, testoverlap = overlap.compute_overlap(train, test, i=i)
     if printoverlap:
-        print("%overlap in train", 100*numtrainoverlap/len(trainitems))
-        print("%overlap in test", 100*numtestoverlap/len(testitems))
-    return 100*numtrainoverlap/len(trainitems), 100*numtestoverlap/len(testitems)
-
-
-def compute_overlaps(ltrain, lftune, strain, sftune, dev, test):
-    ltrain_all = ltrain + lftune
-    strain_all = strain + sftune
-
-    #print("Achieved large-test feature overlap:")
-    test_in_ltrainf, ltrain_in_testf = compute_overlap(ltrain_all, test, i=FEATS, printoverlap=False)
-    #print("Achieved large-test lemma overlap:")
-    test_in_ltrainl, ltrain_in_testl = compute_overlap(ltrain_all, test, i=LEMMA, printoverlap=False)
-    #print("Achieved large-dev feature overlap:")
-    dev_in_ltrainf, ltrain_in_devf = compute_overlap(ltrain_all, dev, i=FEATS, printoverlap=False)
-    #print("Achieved large-dev lemma overlap:")
-    dev_in_ltrainl, ltrain_in_devl = compute_overlap(ltrain_all, dev, i=LEMMA, printoverlap=False)
-
-    #print("Achieved small-test feature overlap:")
-    test_in_strainf, strain_in_testf = compute_overlap(strain_all, test, i=FEATS, printoverlap=False)
-    #print("Achieved small-test lemma overlap:")
-    test_in_strainl, strain_in_testl = compute_overlap(strain_all, test, i=LEMMA, printoverlap=False)
-    #print("Achieved small-dev feature overlap:")
-    dev_in_strainf, strain_in_devf = compute_overlap(strain_all, dev, i=FEATS, printoverlap=False)
-    #print("Achieved small-dev lemma overlap:")
-    dev_in_strainl, strain_in_devl = compute_overlap(strain_all, dev, i=LEMMA, printoverlap=False)
-
-    #print("Achieved dev-test feature overlap:")
-    test_in_devf, dev_in_testf = compute_overlap(dev, test, i=FEATS, printoverlap=False)
-    #print("Achieved dev-test lemma overlap:")
-    test_in_devl, dev_in_testl = compute_overlap(dev, test, i=LEMMA, printoverlap=False)
-
-    return (test_in_ltrainf, ltrain_in_testf, test_in_ltrainl, ltrain_in_testl,
-            dev_in_ltrainf, ltrain_in_devf, dev_in_ltrainl, ltrain_in_devl, 
-            test_in_strainf, strain_in_testf, test_in_strainl, strain_in_testl,
-            dev_in_strainf, strain_in_devf, dev_in_strainl, strain_in_devl, 
-            test_in_devf, dev_in_testf, test_in_devl, dev_in_testl)
-
-
-def subsample(feats_to_triples, triples, overlappablefeats, numsample, overlapratio):
-    overlaptriples = [triple for triple in triples if triple[FEATS] in overlappablefeats]
-    nonoverlaptriples = [triple for triple in triples if triple[FEATS] not in overlappablefeats]
-    num_overlappable = int(numsample * overlapratio)
-    num_nonoverlappable = numsample - num_overlappable
+        print("%overlap in train", trainoverlap)
+        print("%overlap in test", testoverlap)
+    return trainoverlap, testoverlap
+
+
+def compute_overlaps(corpus, ltrain, lftune, strain, sftune, dev, test):
+    # Takes rows of the corpus & returns (test_in_ltrainf, ltrain_in_testf, test_in_ltrainl, ltrain_in_testl,
+    #          dev_in_ltrainf, ltrain_in_devf, dev_in_ltrainl, ltrain_in_devl,
+    #          test_in_strainf, strain_in_testf, test_in_strainl, strain_in_testl,
+    #          dev_in_strainf, strain_in_devf, dev_in_strainl, strain_in_devl,
+    #          test_in_devf, dev_in_testf, test_in_devl, dev_in_testl)
+    lemmas, feats = corpus.column(LEMMA), corpus.column(FEATS)
+    indexes = []
+    for split in (ltrain, lftune, strain, sftune, dev, test):
+        rows = np.asarray(split, dtype=np.int64)
+        indexes.append(overlap.OverlapIndex.from_columns(lemmas[rows], feats[rows]))
+    return overlap.compute_overlaps(*indexes)
+
+
+def subsample(corpus, triples, overlappablefeats, numsample, overlapratio):
+    # triples are rows of the corpus & overlappablefeats the IDs of the overlappable feature sets
+    triples = np.asarray(triples, dtype=np.int64)
+    is_overlappable = np.isin(corpus.column(FEATS)[triples], list(overlappablefeats))
+    overlaptriples = triples[is_overlappable].tolist()
+    nonoverlaptriples = triples[~is_overlappable].tolist()
     random.shuffle(overlaptriples)
     random.shuffle(nonoverlaptriples)
-#    print(num_overlappable,  num_nonoverlappable)
-#    print(len(overlaptriples), len(nonoverlaptriples))
+    # Take the quotas closest to the requested ratio that both pools can fill
+    num_overlappable, num_nonoverlappable = overlap.split_quotas(numsample, overlapratio, len(overlaptriples), len(nonoverlaptriples))
     sampled = overlaptriples[:num_overlappable] + nonoverlaptriples[:num_nonoverlappable]
     remaining = overlaptriples[num_overlappable:] + nonoverlaptriples[num_nonoverlappable:]
-    if len(sampled) < numsample:
-        gap = numsample-len(sampled)
-        print("Must oversample. gap:", gap)
-        if len(nonoverlaptriples) < num_nonoverlappable:
-            sampled = overlaptriples[:num_overlappable + gap] + nonoverlaptriples[:num_nonoverlappable]
-            remaining = overlaptriples[num_overlappable + gap:] + nonoverlaptriples[num_nonoverlappable:]
-        elif len(overlaptriples) < num_overlappable:
-            sampled = nonoverlaptriples[:num_overlappable + gap] + overlaptriples[:num_nonoverlappable]
-            remaining = nonoverlaptriples[num_overlappable + gap:] + overlaptriples[num_nonoverlappable:]
+    if num_overlappable != int(numsample * overlapratio):
+        print("Must oversample. gap:", abs(num_overlappable - int(numsample * overlapratio)))
         print("Num sampled: ", len(sampled), "Num remaining: ", len(remaining))
     return sampled, remaining
 
 
 def validate(ltrain, lftune, dev, test, strain, sftune):
-    ltrain_all = set(ltrain).union(set(lftune))
-    strain_all = set(strain).union(set(sftune))
-    devset = set(dev)
-    testset = set(test)
-    ltdevo = len(ltrain_all.intersection(devset))
-    lttesto = len(ltrain_all.intersection(testset))
-    stdevo = len(strain_all.intersection(devset))
-    sttesto = len(strain_all.intersection(testset))
-    devtesto = len(devset.intersection(testset))
+    # The splits are rows of the same corpus, so each triple is a single row
+    ltrain_all = np.union1d(ltrain, lftune)
+    strain_all = np.union1d(strain, sftune)
+    devset = np.unique(dev)
+    testset = np.unique(test)
+    ltdevo = len(np.intersect1d(ltrain_all, devset, assume_unique=True))
+    lttesto = len(np.intersect1d(ltrain_all, testset, assume_unique=True))
+    stdevo = len(np.intersect1d(strain_all, devset, assume_unique=True))
+    sttesto = len(np.intersect1d(strain_all, testset, assume_unique=True))
+    devtesto = len(np.intersect1d(devset, testset, assume_unique=True))
 #    print("Illicit large train triples in dev?", ltdevo)
 #    print("Illicit large train triples in test?", lttesto)
 #    print("Illicit small train triples in dev?", stdevo)
@@ -162,16 +121,20 @@ def validate(ltrain, lftune, dev, test, strain, sftune):
     return lttesto, ltdevo, sttesto, stdevo, devtesto
 
 
-def naive_sample(triples_to_freqs, indices_to_triples, testsize, dsize, ltsize, lftsize, stsize, sftsize, weight):
-    indices, triples = zip(*tuple(indices_to_triples.items()))
-    if weight:
-        counts = [triples_to_freqs[indices_to_triples[i]] for i in indices]
+def naive_sample(corpus, order, testsize, dsize, ltsize, lftsize, stsize, sftsize, weight, legacy_weighted=False):
+    # Draws rows of the corpus, starting from its rows in file order (see readcorpus)
+    if weight and legacy_weighted:
+        # numpy's weighted choice over the whole corpus; slow, but reproduces splits made before weighted_permutation
+        counts = corpus.freqs[order].tolist()
         sumcounts = sum(counts)
         probs = [count/sumcounts for count in counts]
-        samplei = choice(indices, len(indices), replace=False, p=probs)
-        sample = [indices_to_triples[i] for i in samplei]
+        sample = choice(order, len(order), replace=False, p=probs).tolist()
+    elif weight:
+        # Only the items that end up in train, ftune, dev & test need to be drawn
+        samplei = overlap.weighted_permutation(corpus.freqs[order], ltsize+lftsize+dsize+testsize)
+        sample = order[samplei].tolist()
     else:
-        sample = list(triples)
+        sample = order.tolist()
         random.shuffle(sample)
 
     ltrain_all = sample[:ltsize+lftsize]
@@ -195,9 +158,10 @@ def naive_sample(triples_to_freqs, indices_to_triples, testsize, dsize, ltsize,
     return ltrain, lftune, dev, test, strain, sftune
 
 
-def nofreq_feataware_sample(feats_to_triples, triples, testsize, dsize, ltsize, lftsize, stsize, sftsize, feat_overlap_ratio):
-
-    featlist = sorted(feats_to_triples.keys())
+def nofreq_feataware_sample(corpus, triples, testsize, dsize, ltsize, lftsize, stsize, sftsize, feat_overlap_ratio, profiler=profiling.NULL):
+    # triples are the sorted rows of the corpus to sample from
+    feats_of = corpus.column(FEATS)
+    featlist = list(range(len(corpus.vocab[FEATS])))
     random.shuffle(featlist)
     partition = int(feat_overlap_ratio * len(featlist))
     origpartition = partition
@@ -210,37 +174,44 @@ def nofreq_feataware_sample(feats_to_triples, triples, testsize, dsize, ltsize,
     else:
         print("sampling small train...")
 
-    largetrainsample = {}
-    while len(largetrainsample) < numlargetrain:
-        if partition == origpartition + 1:
-            print("Must oversample large train. gap:", numlargetrain-len(largetrainsample))
-        overlappablefeats = set(featlist[:partition])
-        overlaptriples = [triple for triple in triples if triple[FEATS] in overlappablefeats]
-#        print(len(overlaptriples))
+    with profiler.phase("partition_search") as record:
+        # Find the smallest feature partition with enough triples for large train straight from the per-feature counts
+        triples = np.asarray(triples, dtype=np.int64)
+        featcounts = np.bincount(feats_of[triples], minlength=len(featlist))
+        featsizes = featcounts[featlist].tolist()
+        partition = overlap.smallest_partition(featsizes, numlargetrain, partition)
+        if partition > origpartition:
+            print("Must oversample large train. gap:", numlargetrain-sum(featsizes[:origpartition]))
+        overlappablefeats = np.zeros(len(featlist), dtype=bool)
+        overlappablefeats[featlist[:partition]] = True
+        overlaptriples = triples[overlappablefeats[feats_of[triples]]].tolist()
         random.shuffle(overlaptriples)
         largetrainsample = overlaptriples[:numlargetrain]
-#        print(len(largetrainsample))
-        remaining = sorted(set(triples).difference(largetrainsample))
-        partition += 1
-    feats_in_train = set([triple[FEATS] for triple in largetrainsample])
+        if len(largetrainsample) < numlargetrain:
+            print("Not enough triples for large train. gap:", numlargetrain-len(largetrainsample))
+        remaining = np.setdiff1d(triples, largetrainsample).tolist()
+        feats_in_train = set(feats_of[largetrainsample].tolist())
+        # The partition is found in one search; partition_iterations is how many steps the old growth loop would have taken
+        record.update(partition_iterations=partition - origpartition, partition_size=partition, overlappable_triples=len(overlaptriples))
 
     random.shuffle(largetrainsample)
     ltrain = largetrainsample[:ltsize]
     lftune = largetrainsample[ltsize:]
 
-    if numlargetrain != numsmalltrain:
-        print("sampling small train...")
-    smalltrainsample, _ = subsample(feats_to_triples, ltrain, feats_in_train, numsmalltrain, 1)
-    random.shuffle(smalltrainsample)
-    strain = smalltrainsample[:stsize]
-    sftune = smalltrainsample[stsize:]
+    with profiler.phase("subsample", test=testsize, dev=dsize):
+        if numlargetrain != numsmalltrain:
+            print("sampling small train...")
+        smalltrainsample, _ = subsample(corpus, ltrain, feats_in_train, numsmalltrain, 1)
+        random.shuffle(smalltrainsample)
+        strain = smalltrainsample[:stsize]
+        sftune = smalltrainsample[stsize:]
 
-    print("sampling test...")
-    test, remaining = subsample(feats_to_triples, remaining, feats_in_train, testsize, feat_overlap_ratio)
+        print("sampling test...")
+        test, remaining = subsample(corpus, remaining, feats_in_train, testsize, feat_overlap_ratio)
 
-    print("sampling dev...")
-    feats_in_test = set([triple[FEATS] for triple in test])
-    dev, remaining = subsample(feats_to_triples, remaining, feats_in_test, dsize, feat_overlap_ratio)
+        print("sampling dev...")
+        feats_in_test = set(feats_of[test].tolist())
+        dev, remaining = subsample(corpus, remaining, feats_in_test, dsize, feat_overlap_ratio)
     if numlargetrain != numsmalltrain:
         print("Achieved Sizes (lt, lft, st, sft, d, test):", len(ltrain), len(lftune), len(strain), len(sftune), len(dev), len(test))
     else:
@@ -266,45 +237,73 @@ def close_log(logger):
     logger.close()
 
 
-def main(freqfname, rawfname, outdir, stsize, ltsize, sftsize, lftsize, dsize, testsize, foverlap, language, seed):
+def main(freqfname, rawfname, outdir, stsize, ltsize, sftsize, lftsize, dsize, testsize, foverlap, language, seed, legacy_weighted=False, cache_dir=None, compression=None, force=False, profile=False):
+    # Skip the language if the manifest shows its splits were already made from the same inputs & parameters
+    key = "%s_%s" % (language, seed)
+    inputs = manifest.file_hashes([freqfname, rawfname])
+    params = {"small": stsize, "large": ltsize, "smallfinetune": sftsize, "largefinetune": lftsize, "dev": dsize, "test": testsize,
+        "foverlap": foverlap, "language": language, "seed": seed, "legacy_weighted": legacy_weighted, "compression": compression}
+    if not force and manifest.up_to_date(manifest.read_manifest(outdir).get(key), SPLIT_VERSION, inputs, params, outdir):
+        print("Splits for %s (seed %s) are up to date, skipping" % (language, seed))
+        return
+    written = []
     logger = init_log(outdir)
+    profiler = profiling.Profiler(language=language, seed=seed) if profile else profiling.NULL
     print("Input:", freqfname)
     print("Input:", rawfname)
-    triples, triples_to_freqs, feats_to_triples, indices_to_triples = readcorpus(freqfname)
-    _, triples_to_0_raw, _, indices_to_triples_raw = readcorpus(rawfname)
+    with profiler.phase("read") as record:
+        corpus, order = readcorpus(freqfname, cache_dir)
+        rawcorpus, raworder = readcorpus(rawfname, cache_dir)
+        record.update(triples=len(corpus), raw_triples=len(rawcorpus), feature_sets=len(corpus.vocab[FEATS]))
     print("Output:", outdir)
     print("Seed:", seed)
-    print("contains %s items" % len(triples))
-    print("contains %s unique feature sets" % len(feats_to_triples))
+    print("contains %s items" % len(corpus))
+    print("contains %s unique feature sets" % len(corpus.vocab[FEATS]))
     print("small train:", stsize+sftsize, "large train:", ltsize+lftsize, "dev:", dsize, "test:", testsize)
 
     print("Naive Uniform Sampling...")
     set_seed(seed)
-    ltrain_uni, lftune_uni, dev_uni, test_uni, strain_uni, sftune_uni = naive_sample(triples_to_0_raw, indices_to_triples_raw, testsize, dsize, ltsize, lftsize, stsize, sftsize, weight=False)
-    overlaps = compute_overlaps(ltrain_uni, lftune_uni, strain_uni, sftune_uni, dev_uni, test_uni)
-    illicitoverlaps = validate(ltrain_uni, lftune_uni, dev_uni, test_uni, strain_uni, sftune_uni)
+    strategy = profiler.child(strategy="naive_uni")
+    with strategy.phase("subsample"):
+        ltrain_uni, lftune_uni, dev_uni, test_uni, strain_uni, sftune_uni = naive_sample(rawcorpus, raworder, testsize, dsize, ltsize, lftsize, stsize, sftsize, weight=False)
+    with strategy.phase("validate"):
+        overlaps = compute_overlaps(rawcorpus, ltrain_uni, lftune_uni, strain_uni, sftune_uni, dev_uni, test_uni)
+        illicitoverlaps = validate(ltrain_uni, lftune_uni, dev_uni, test_uni, strain_uni, sftune_uni)
     log(logger, language, "naive_uni", seed, ltrain_uni, lftune_uni, dev_uni, test_uni, strain_uni, sftune_uni, overlaps, illicitoverlaps)
-    writesamples(os.path.join(outdir,"naive_uniform"), language, seed, ltrain_uni, lftune_uni, dev_uni, test_uni, strain_uni, sftune_uni)
+    with strategy.phase("write", files=7):
+        written += writesamples(rawcorpus, os.path.join(outdir,"naive_uniform"), language, seed, ltrain_uni, lftune_uni, dev_uni, test_uni, strain_uni, sftune_uni, compression)
 
     print("Naive Weighted Sampling...")
     set_seed(seed)
-    ltrain_wght, lftune_wght, dev_wght, test_wght, strain_wght, sftune_wght = naive_sample(triples_to_freqs, indices_to_triples, testsize, dsize, ltsize, lftsize, stsize, sftsize, weight=True)
-    overlaps = compute_overlaps(ltrain_wght, lftune_wght, strain_wght, sftune_wght, dev_wght, test_wght)
-    illicitoverlaps = validate(ltrain_wght, lftune_wght, dev_wght, test_wght, strain_wght, sftune_wght)
+    strategy = profiler.child(strategy="naive_wght")
+    with strategy.phase("subsample"):
+        ltrain_wght, lftune_wght, dev_wght, test_wght, strain_wght, sftune_wght = naive_sample(corpus, order, testsize, dsize, ltsize, lftsize, stsize, sftsize, weight=True, legacy_weighted=legacy_weighted)
+    with strategy.phase("validate"):
+        overlaps = compute_overlaps(corpus, ltrain_wght, lftune_wght, strain_wght, sftune_wght, dev_wght, test_wght)
+        illicitoverlaps = validate(ltrain_wght, lftune_wght, dev_wght, test_wght, strain_wght, sftune_wght)
     log(logger, language, "naive_wght", seed, ltrain_wght, lftune_wght, dev_wght, test_wght, strain_wght, sftune_wght, overlaps, illicitoverlaps)
-    writesamples(os.path.join(outdir,"naive_weighted"), language, seed, ltrain_wght, lftune_wght, dev_wght, test_wght, strain_wght, sftune_wght)
+    with strategy.phase("write", files=7):
+        written += writesamples(corpus, os.path.join(outdir,"naive_weighted"), language, seed, ltrain_wght, lftune_wght, dev_wght, test_wght, strain_wght, sftune_wght, compression)
 
     set_seed(seed)
     print("Train Feature in Test Overlap Aware Sampling...")
     print("Requested train-test feature overlap", round(foverlap*100,2))
 
-    ltrain_fo, lftune_fo, dev_fo, test_fo, strain_fo, sftune_fo = nofreq_feataware_sample(feats_to_triples, triples, testsize, dsize, ltsize, lftsize, stsize, sftsize, foverlap)
-    overlaps = compute_overlaps(ltrain_fo, lftune_fo, strain_fo, sftune_fo, dev_fo, test_fo)
-    illicitoverlaps = validate(ltrain_fo, lftune_fo, dev_fo, test_fo, strain_fo, sftune_fo)
+    strategy = profiler.child(strategy="featoverlap")
+    ltrain_fo, lftune_fo, dev_fo, test_fo, strain_fo, sftune_fo = nofreq_feataware_sample(corpus, list(range(len(corpus))), testsize, dsize, ltsize, lftsize, stsize, sftsize, foverlap, strategy)
+    with strategy.phase("validate"):
+        overlaps = compute_overlaps(corpus, ltrain_fo, lftune_fo, strain_fo, sftune_fo, dev_fo, test_fo)
+        illicitoverlaps = validate(ltrain_fo, lftune_fo, dev_fo, test_fo, strain_fo, sftune_fo)
     log(logger, language, "featoverlap", seed, ltrain_fo, lftune_fo, dev_fo, test_fo, strain_fo, sftune_fo, overlaps, illicitoverlaps)
-    writesamples(os.path.join(outdir,"overlap_aware"), language, seed, ltrain_fo, lftune_fo, dev_fo, test_fo, strain_fo, sftune_fo)
+    with strategy.phase("write", files=7):
+        written += writesamples(corpus, os.path.join(outdir,"overlap_aware"), language, seed, ltrain_fo, lftune_fo, dev_fo, test_fo, strain_fo, sftune_fo, compression)
 
     close_log(logger)
+    if profile:
+        # Appended to like the log, since each run splits a single language
+        with open(os.path.join(outdir, "profile.jsonl"), "a") as f:
+            profiling.write_records(f, profiler.records)
+    manifest.update_manifest(outdir, key, manifest.make_entry(SPLIT_VERSION, inputs, params, outdir, written))
     
 
 if __name__=="__main__":
@@ -321,8 +320,13 @@ if __name__=="__main__":
     parser.add_argument("--foverlap", type=float, help = "requested max train-test feature set overlap. Float in range [0,1]")
     parser.add_argument("--lang", help = "language to be written in output filenames")
     parser.add_argument("--seed", help = "random seed")
+    parser.add_argument("--legacy_weighted", action="store_true", help = "use numpy's weighted choice for naive weighted sampling, reproducing splits made with earlier versions")
+    parser.add_argument("--cache_dir", help = "directory to cache parsed input files in, so later runs can skip parsing")
+    parser.add_argument("--compress", choices=list(SUFFIXES), help = "compress the written split files")
+    parser.add_argument("--force", action="store_true", help = "make the splits again even if the manifest shows they are up to date")
+    parser.add_argument("--profile", action="store_true", help = "append the time, memory & item counts of every phase to profile.jsonl in outdir")
     args = parser.parse_args()
     
 
-    main(args.freqfname, args.rawfname, args.outdir, args.small, args.large, args.smallfinetune, args.largefinetune, args.dev, args.test, args.foverlap, args.lang, args.seed)
+    main(args.freqfname, args.rawfname, args.outdir, args.small, args.large, args.smallfinetune, args.largefinetune, args.dev, args.test, args.foverlap, args.lang, args.seed, args.legacy_weighted, args.cache_dir, args.compress, args.force, args.profile)
 
@@ -0,0 +1,104 @@
+import os, sys, json, argparse
+from corpus import file_hash, find_file, write_text
+
+MANIFEST = "manifest.json"
+# Files the splitters keep next to the splits that aren't splits themselves
+BOOKKEEPING = {MANIFEST, "profile.jsonl", "log.tsv"}
+
+
+def read_manifest(directory):
+    """Read the manifest of an output directory, mapping each entry's key to what produced its files"""
+    path = os.path.join(directory, MANIFEST)
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def update_manifest(directory, key, entry):
+    """Record the entry for key in the manifest of an output directory, keeping the other entries"""
+    entries = read_manifest(directory)
+    entries[key] = entry
+    write_text(os.path.join(directory, MANIFEST), json.dumps(entries, indent=1, sort_keys=True) + "\n")
+
+
+def file_hashes(paths, directory=None):
+    """Hash each file, keyed by its path (relative to directory if given)"""
+    hashes = {}
+    for path in paths:
+        path = find_file(path)
+        hashes[os.path.relpath(path, directory) if directory else os.path.abspath(path)] = file_hash(path)
+    return hashes
+
+
+def make_entry(version, inputs, params, directory, outputs, result=None):
+    """Describe the files written to directory: the input hashes, parameters & algorithm version that produced them & their own hashes"""
+    return {"version": version, "inputs": inputs, "params": params, "outputs": file_hashes(outputs, directory), "result": result}
+
+
+def stale(entry, directory):
+    """Return the reasons the files of a manifest entry are out of date, rehashing its inputs & outputs (empty if up to date)"""
+    reasons = []
+    for path, digest in entry["inputs"].items():
+        if not os.path.exists(path):
+            reasons.append(f"input {path} is missing")
+        elif file_hash(path) != digest:
+            reasons.append(f"input {path} has changed")
+    for path, digest in entry["outputs"].items():
+        full_path = os.path.join(directory, path)
+        if not os.path.exists(full_path):
+            reasons.append(f"output {path} is missing")
+        elif file_hash(full_path) != digest:
+            reasons.append(f"output {path} has changed")
+    return reasons
+
+
+def up_to_date(entry, version, inputs, params, directory):
+    """Check whether a manifest entry was made from the same inputs, parameters & version, and its files are untouched"""
+    if entry is None or entry["version"] != version or entry["inputs"] != inputs or entry["params"] != params:
+        return False
+    for path, digest in entry["outputs"].items():
+        full_path = os.path.join(directory, path)
+        if not os.path.exists(full_path) or file_hash(full_path) != digest:
+            return False
+    return True
+
+
+def check_tree(root):
+    """Check every manifest under root against the files on disk, printing the out-of-date entries & the split files no entry covers
+
+    A split file (anything but the manifests, logs & profiles the splitters keep alongside) that no manifest entry lists
+    among its outputs can't be checked, so each language with such files is reported as unknown. Returns how many
+    out-of-date entries & unknown languages there are.
+    """
+    num_stale = 0
+    covered = set()
+    split_files = []
+    for directory, _, files in sorted(os.walk(root)):
+        for key, entry in sorted(read_manifest(directory).items()):
+            covered.update(os.path.normpath(os.path.join(directory, path)) for path in entry["outputs"])
+            reasons = stale(entry, directory)
+            if reasons:
+                num_stale += 1
+                print(f"{os.path.relpath(directory, root)}\t{key}\t{'; '.join(reasons)}")
+        split_files += [os.path.normpath(os.path.join(directory, fname)) for fname in sorted(files) if fname not in BOOKKEEPING]
+    # Group the uncovered files by their directory & language (the file name up to its first dot)
+    unknown = {}
+    for path in split_files:
+        if path not in covered:
+            directory, fname = os.path.split(path)
+            unknown.setdefault((os.path.relpath(directory, root), fname.split(".")[0]), []).append(fname)
+    for (directory, lang), fnames in sorted(unknown.items()):
+        print(f"{directory}\t{lang}\tunknown: {', '.join(fnames)} not covered by any manifest entry")
+    return num_stale + len(unknown)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check whether the splits under a directory are up to date with their manifests")
+    parser.add_argument("root", help="The split tree to check")
+    args = parser.parse_args()
+    if not os.path.isdir(args.root):
+        parser.error(f"{args.root} is not a directory")
+    num_stale = check_tree(args.root)
+    print(f"{num_stale} out-of-date or unknown entries" if num_stale else "All splits are up to date", file=sys.stderr)
+    sys.exit(1 if num_stale else 0)
@@ -0,0 +1,133 @@
+from collections import Counter
+import numpy as np
+
+LEMMA = 0
+FEATS = 2
+
+
+class OverlapIndex:
+    """Counted hash index over the lemmas and feature sets of a single split"""
+
+    def __init__(self, triples=()):
+        self.size = 0
+        self.counts = {LEMMA: Counter(), FEATS: Counter()}
+        for triple in triples:
+            self.size += 1
+            self.counts[LEMMA][triple[LEMMA]] += 1
+            self.counts[FEATS][triple[FEATS]] += 1
+
+    @classmethod
+    def from_columns(cls, lemmas, feats):
+        """Build the index from arrays of interned lemma & feature set IDs"""
+        index = cls()
+        index.size = len(lemmas)
+        for i, column in ((LEMMA, lemmas), (FEATS, feats)):
+            items, counts = np.unique(column, return_counts=True)
+            index.counts[i] = Counter(dict(zip(items.tolist(), counts.tolist())))
+        return index
+
+    def __add__(self, other):
+        """Combine the indexes of two splits, as if their triples had been concatenated"""
+        combined = OverlapIndex()
+        combined.size = self.size + other.size
+        for i in (LEMMA, FEATS):
+            combined.counts[i] = self.counts[i] + other.counts[i]
+        return combined
+
+    def num_overlapping(self, other, i):
+        """Count the triples in this split whose item i also occurs in the other split"""
+        othercounts = other.counts[i]
+        return sum(count for item, count in self.counts[i].items() if item in othercounts)
+
+    def overlap(self, other, i):
+        """Return the percent overlap of this split with the other split and vice versa"""
+        return 100*self.num_overlapping(other, i)/self.size, 100*other.num_overlapping(self, i)/other.size
+
+
+def split_quotas(numsample, overlap_ratio, numoverlap, numnonoverlap):
+    """Pick how many overlapping & non-overlapping triples to sample, as close to the requested overlap ratio as the pools allow"""
+    wanted = int(numsample * overlap_ratio)
+    # The overlap quota has to leave no more for the non-overlapping pool than it holds, and has to fit its own pool
+    quota = min(max(wanted, numsample - numnonoverlap), numoverlap)
+    return quota, min(numsample - quota, numnonoverlap)
+
+
+def joint_quotas(numsample, lemma_ratio, feat_ratio, pools):
+    """Pick how many triples to sample from each of the (lemma seen, features seen) pools to hit both overlap ratios
+
+    pools holds the number of available triples whose (lemma, features) are (seen, seen), (seen, unseen),
+    (unseen, seen) and (unseen, unseen). Both ratios are hit exactly whenever the pools allow it; otherwise the
+    quotas are clipped to the pools and any shortfall is filled from the pools with triples to spare, starting
+    with the ones that add the least overlap.
+    """
+    both, lemma_only, feat_only, neither = pools
+    lemmas = int(numsample * lemma_ratio)
+    feats = int(numsample * feat_ratio)
+    # Everything is determined by the number of triples with both seen; find the range of it that fits every pool
+    lowest = max(0, lemmas - lemma_only, feats - feat_only, lemmas + feats - numsample)
+    highest = min(both, lemmas, feats, lemmas + feats - numsample + neither)
+    # Prefer the number we'd expect if lemma & feature overlap were independent
+    expected = round(lemmas * feats / numsample) if numsample else 0
+    if lowest > highest:
+        # The pools can't hit both ratios, so only keep the quotas themselves non-negative
+        lowest, highest = max(0, lemmas + feats - numsample), min(lemmas, feats)
+    shared = min(max(expected, lowest), highest)
+    quotas = [shared, lemmas - shared, feats - shared, numsample - lemmas - feats + shared]
+    quotas = [min(max(quota, 0), pool) for quota, pool in zip(quotas, pools)]
+    for k in (3, 1, 2, 0):
+        quotas[k] += min(numsample - sum(quotas), pools[k] - quotas[k])
+    return tuple(quotas)
+
+
+def smallest_partition(sizes, target, start=0):
+    """Find the smallest partition (of at least start items) whose items hold at least target triples in total
+
+    sizes holds the number of triples of each item in partition order. If even all items together hold fewer than
+    target triples, the partition covers all of them.
+    """
+    totals = np.concatenate([[0], np.cumsum(sizes)])
+    return min(max(start, int(np.searchsorted(totals, target, side="left"))), len(sizes))
+
+
+def weighted_permutation(weights, numsample, rng=np.random):
+    """Draw numsample positions without replacement with probability proportional to weights, in the order drawn
+
+    Giving each position an exponential key with rate equal to its weight & sorting by key is equivalent to drawing
+    one at a time (Efraimidis & Spirakis), so only the numsample smallest keys have to be found & sorted. Positions
+    with no weight are only drawn once the others run out, in random order. The keys come from rng, a NumPy
+    Generator or the np.random module itself.
+    """
+    weights = np.asarray(weights, dtype=np.float64)
+    numsample = min(numsample, len(weights))
+    if numsample == 0:
+        return np.zeros(0, dtype=np.int64)
+    keys = rng.standard_exponential(len(weights))
+    weighted = weights > 0
+    keys[weighted] /= weights[weighted]
+    # Shift the keys of the positions with no weight past every other key, keeping them in random order
+    keys[~weighted] += keys[weighted].max(initial=0.) + 1
+    smallest = np.argpartition(keys, numsample - 1)[:numsample]
+    return smallest[np.argsort(keys[smallest], kind="stable")]
+
+
+def compute_overlap(train, test, i=FEATS):
+    """Compute the percent of train items seen in test and the percent of test items seen in train"""
+    trainindex = train if isinstance(train, OverlapIndex) else OverlapIndex(train)
+    testindex = test if isinstance(test, OverlapIndex) else OverlapIndex(test)
+    return trainindex.overlap(testindex, i)
+
+
+def compute_overlaps(ltrain, lftune, strain, sftune, dev, test):
+    """Compute every pairwise feature & lemma overlap between (large / small) train, dev, and test
+
+    Each split is either its triples or an OverlapIndex already built over them.
+    """
+    # Index each split once; train and ftune are combined by adding their counts
+    ltrain, lftune, strain, sftune, dev, test = (split if isinstance(split, OverlapIndex) else OverlapIndex(split) for split in (ltrain, lftune, strain, sftune, dev, test))
+    ltrain_all = ltrain + lftune
+    strain_all = strain + sftune
+
+    overlaps = ()
+    for first, second in ((ltrain_all, test), (ltrain_all, dev), (strain_all, test), (strain_all, dev), (dev, test)):
+        overlaps += first.overlap(second, FEATS) + first.overlap(second, LEMMA)
+    return overlaps
@@ -0,0 +1,76 @@
+import os, sys, json, time, contextlib
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows; peak RSS is then left out
+    resource = None
+
+
+def peak_rss_mib():
+    """The peak resident set size of this process so far, in MiB"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS & in KiB elsewhere
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+
+def rss_mib():
+    """The current resident set size of this process in MiB, where /proc makes it cheap to read"""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError):
+        return None
+
+
+class Profiler:
+    """Record the wall time, memory & item counts of each phase of a run as flat records
+
+    Every record also holds the profiler's fields (e.g. the language & seed); child() makes a profiler with more
+    fields that adds to the same records.
+    """
+
+    def __init__(self, records=None, **fields):
+        self.records = [] if records is None else records
+        self.fields = fields
+
+    def child(self, **fields):
+        return Profiler(self.records, **{**self.fields, **fields})
+
+    @contextlib.contextmanager
+    def phase(self, name, **counts):
+        """Time the phase run inside the with block; the yielded record can be given more counts along the way"""
+        record = {**self.fields, "phase": name}
+        start = time.perf_counter()
+        yield record
+        record["seconds"] = time.perf_counter() - start
+        record["rss_mib"] = rss_mib()
+        # The two are read differently & can disagree by a page or so, so the peak never reads below the current size
+        record["peak_rss_mib"] = max(filter(None, (peak_rss_mib(), record["rss_mib"])), default=None)
+        record.update(counts)
+        self.records.append(record)
+
+
+class NullProfiler:
+    """Stands in for a Profiler when profiling is off, recording nothing"""
+    records = ()
+
+    def child(self, **fields):
+        return self
+
+    @contextlib.contextmanager
+    def phase(self, name, **counts):
+        yield {}
+
+
+NULL = NullProfiler()
+
+
+def write_records(f, records):
+    """Write records to an open file as JSON lines"""
+    for record in records:
+        # Counts may be NumPy scalars
+        f.write(json.dumps(record, default=lambda x: x.item()) + "\n")
+    f.flush()
@@ -0,0 +1,98 @@
+import io, random, contextlib
+import numpy as np
+import lemma_overlap_splits, evaluation
+from corpus import LEMMA, INFL, FEATS
+from lemma_overlap_splits import read_corpus
+
+
+class Split:
+    """An in-memory train / ftune / test split of a Corpus, with the seen-item indexes needed to score it
+
+    train, ftune & test hold rows of the corpus. seen maps "lemma" & "fts" to boolean masks over the corpus
+    vocabulary of whether each lemma / feature set occurs in train + ftune, and trained to the same for train only,
+    so marking the test rows is a single lookup per mask.
+    """
+    __slots__ = ("corpus", "train", "ftune", "test", "trained", "seen", "marks")
+
+    def __init__(self, corpus, train, ftune, test):
+        self.corpus = corpus
+        self.train, self.ftune, self.test = (np.asarray(rows, dtype=np.int64) for rows in (train, ftune, test))
+        self.trained, self.seen = {}, {}
+        for name, i in (("lemma", LEMMA), ("fts", FEATS)):
+            column = corpus.column(i)
+            self.trained[name] = np.zeros(len(corpus.vocab[i]), dtype=bool)
+            self.trained[name][column[self.train]] = True
+            self.seen[name] = self.trained[name].copy()
+            self.seen[name][column[self.ftune]] = True
+        # The test rows marked the same way as evaluation.mark_seen marks a test file
+        self.marks = {}
+        for name, i in (("lemma", LEMMA), ("fts", FEATS)):
+            test_items = corpus.column(i)[self.test]
+            self.marks[f"train_{name}"] = self.trained[name][test_items]
+            self.marks[f"seen_{name}"] = self.seen[name][test_items]
+
+    @classmethod
+    def sample(cls, corpus, line_dict, family, lang, trainsize, testsize, overlap_item=LEMMA, overlap_ratio=0.5, ftuneprop=0.125, seed=1, start1=False,
+        feat_overlap_ratio=None, verbose=False, legacy_partition=False):
+        """Sample a split with controlled overlap, seeded the same way as lemma_overlap_splits so it matches the written split
+
+        With overlap_item BOTH, overlap_ratio controls the lemma overlap & feat_overlap_ratio the feature overlap. A corpus
+        read with frequencies (see lemma_overlap_splits.read_corpus) is sampled by them. legacy_partition is passed on to
+        lemma_overlap_splits.controlled_overlap_sample.
+        """
+        random.seed(f"{seed}/{family}/{lang}")
+        with contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO()):
+            if overlap_item == lemma_overlap_splits.BOTH:
+                train, ftune, test = lemma_overlap_splits.joint_overlap_sample(corpus, list(range(len(corpus))), trainsize, testsize, ftuneprop,
+                    overlap_ratio, feat_overlap_ratio, weights=lemma_overlap_splits.sampling_weights(corpus))
+            else:
+                train, ftune, test = lemma_overlap_splits.controlled_overlap_sample(corpus, line_dict, list(range(len(corpus))), trainsize, testsize,
+                    ftuneprop, overlap_item, overlap_ratio, start1, weights=lemma_overlap_splits.sampling_weights(corpus), legacy_partition=legacy_partition)
+        return cls(corpus, train, ftune, test)
+
+    @classmethod
+    def kfold(cls, corpus, line_dict, family, lang, folds, trainsize, testsize, overlap_item=LEMMA, overlap_ratio=0.5, ftuneprop=0.125, seed=1, verbose=False):
+        """Sample the cross-validation folds of lemma_overlap_splits --folds, all sharing the corpus & one partition of its items
+
+        A fold is None if the items outside its held-out group have too few triples for train.
+        """
+        random.seed(f"{seed}/{family}/{lang}")
+        with contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO()):
+            samples = lemma_overlap_splits.kfold_sample(corpus, line_dict, list(range(len(corpus))), folds, trainsize, testsize, ftuneprop, overlap_item, overlap_ratio,
+                weights=lemma_overlap_splits.sampling_weights(corpus))
+        return [None if sample is None else cls(corpus, *sample) for sample in samples]
+
+    def triples(self, split="test"):
+        """Return the (lemma, inflection, features) triples of train, ftune or test"""
+        return self.corpus.decode(getattr(self, split))
+
+    def validate(self, overlap_item=LEMMA, printoverlap=False):
+        """Check the split & return the percent overlap of overlap_item & of the other item between train + ftune and test"""
+        return lemma_overlap_splits.validate(self.corpus, self.train, self.ftune, self.test, overlap_item, printoverlap)
+
+    def targets(self):
+        """Return the gold inflection of every test row"""
+        vocab = self.corpus.vocab[INFL]
+        return [vocab[n] for n in self.corpus.column(INFL)[self.test].tolist()]
+
+    def score(self, correct):
+        """Score whether each test row was predicted correctly, returning the same scores as evaluation.evaluate_language
+
+        correct may be shorter than test, in which case only the first rows (the ones decoded so far) are scored.
+        """
+        correct = np.asarray(correct, dtype=bool)
+        num_rows = min(len(self.test), len(correct))
+        scores = evaluation.evaluate({k: v[:num_rows] for k, v in self.marks.items()}, correct[:num_rows])
+        scores["seen_lemmas"] = int(np.count_nonzero(self.seen["lemma"]))
+        scores["train_lemmas"] = int(np.count_nonzero(self.trained["lemma"]))
+        return scores
+
+    def evaluate(self, predictions):
+        """Score predicted inflections, given in test order, against the gold test inflections"""
+        predictions = np.asarray(predictions, dtype=object)
+        targets = np.asarray(self.targets()[:len(predictions)], dtype=object)
+        return self.score(predictions[:len(targets)] == targets)
+
+    def write(self, outdir, family, lang, seed, compression=None):
+        """Write the split out the same way lemma_overlap_splits does, returning the paths written"""
+        return lemma_overlap_splits.write_splits(outdir, family.lower(), lang, seed, self.triples("train"), self.triples("ftune"), self.triples("test"), compression)
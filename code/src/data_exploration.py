@@ -1,126 +1,205 @@
+import os
+from functools import lru_cache, cached_property
 import numpy as np
+import pandas as pd
+from corpus import read_unimorph, LEMMA, FEATS
+from features import FeatureAtomIndex, NOVEL_COMBINATION
 
  
-def parse_files(path, element=-1):
+def parse_files(path, element=-1, cache_dir=None):
     """Helper function to get the train, dev, and test elements for a given path"""
-    def get_element(full_path, element):
-        return [line.strip().split("\t")[element] for line in open(full_path).readlines()]
-    return get_element(f"{path}.trn", element), get_element(f"{path}.dev", element), get_element(f"{path}.tst", element)
+    # The split files have three columns, so -1 is the feature set
+    element = element % 3
+    return tuple(read_unimorph(f"{path}.{split}", cache_dir).column(element) for split in ("trn", "dev", "tst"))
+
+class LanguageProfile:
+    """The train, dev, and test splits of a single language, read once, with every metric computed lazily from them"""
+
+    def __init__(self, path, cache_dir=None):
+        self.path = path
+        self.train, self.dev, self.test = (read_unimorph(f"{path}.{split}", cache_dir) for split in ("trn", "dev", "tst"))
+
+    def proportion_seen(self, split, seen, element):
+        """Calculate the proportion of a split's elements that are in the seen set"""
+        # Look up each distinct element once & count its rows via the interned IDs
+        vocab = split.vocab[element]
+        is_seen = np.fromiter((x in seen for x in vocab), dtype=bool, count=len(vocab))
+        return np.count_nonzero(is_seen[split.ids[:, element]])/len(split)
+
+    @cached_property
+    def feature_overlap(self):
+        """The proportion of test featuresets that were seen during training"""
+        return self.proportion_seen(self.test, self.train.items(FEATS), FEATS)
+
+    @cached_property
+    def lemma_overlap(self):
+        """The proportion of test lemmas that were seen during training"""
+        return self.proportion_seen(self.test, self.train.items(LEMMA) | self.dev.items(LEMMA), LEMMA)
+
+    @cached_property
+    def unique_lemmas(self):
+        """The number of unique lemmas in train"""
+        return len(self.train.vocab[LEMMA])
+
+    @cached_property
+    def unique_featuresets(self):
+        """The number of unique featuresets in train"""
+        return len(self.train.vocab[FEATS])
+
+    @cached_property
+    def atoms(self):
+        """The feature atom index over every featureset in train, dev, and test"""
+        return FeatureAtomIndex(self.train.vocab[FEATS] + self.dev.vocab[FEATS] + self.test.vocab[FEATS])
+
+    @cached_property
+    def unique_features(self):
+        """The number of unique features in train"""
+        return np.count_nonzero(self.atoms.atom_mask(self.atoms.lookup(self.train.vocab[FEATS])))
+
+    @cached_property
+    def atom_overlap(self):
+        """The proportion of the features of test featuresets that were seen during training"""
+        return self.atoms.atom_overlap(self.atoms.table_ids(self.test), self.atoms.lookup(self.train.vocab[FEATS]))
+
+    @cached_property
+    def novel_combinations(self):
+        """The proportion of test featuresets that are unseen in training, but made up only of features seen in training"""
+        classes = self.atoms.classify(self.atoms.table_ids(self.test), self.atoms.lookup(self.train.vocab[FEATS]))
+        return np.count_nonzero(classes == NOVEL_COMBINATION)/len(self.test)
+
+    @cached_property
+    def train_size(self):
+        """The number of triples in train"""
+        assert(len(self.train) != 0 and len(self.dev) != 0 and len(self.test) != 0)
+        return len(self.train)
+
+
+@lru_cache(maxsize=None)
+def load_profile(path):
+    """Load a language once, so every metric over the same path shares the parsed files (call load_profile.cache_clear() if they change)"""
+    return LanguageProfile(path)
 
 def feature_overlap(path):
     """Calculate the percent of featuresets that were seen during training"""
-    train_feats, dev_feats, test_feats = parse_files(path, -1)
-    seen_feats = set(train_feats)
-    proportion_seen = len([f for f in test_feats if f in seen_feats])/len(test_feats)
-    return proportion_seen 
+    return load_profile(path).feature_overlap
 
 def lemma_overlap(path):
     """Calculate the percent of lemmas that were seen during training"""
-    train_lemmas, dev_lemmas, test_lemmas = parse_files(path, 0)
-    seen_lemmas = set(train_lemmas + dev_lemmas)
-    proportion_seen = len([f for f in test_lemmas if f in seen_lemmas])/len(test_lemmas)
-    return proportion_seen
+    return load_profile(path).lemma_overlap
     
 
 def unique_lemmas(path):
     """Return the number of unique lemmas in train + dev"""
-    train_lemmas, dev_lemmas, test_lemmas = parse_files(path, 0)
-    return len(set(train_lemmas))
+    return load_profile(path).unique_lemmas
 
 def unique_featuresets(path):
     """Return the number of unique features in train + dev"""
-    train_feats, dev_feats, test_feats = parse_files(path, -1)
-    return len(set(train_feats))
+    return load_profile(path).unique_featuresets
 
 def unique_features(path):
     """Return the number of unique features in train + dev"""
-    train_feats, dev_feats, test_feats = parse_files(path, -1)
-    unique_feats = set()
-    for feat in train_feats:
-        for f in feat.strip().split(";"):
-            unique_feats.add(f)
-    return len(unique_feats)
+    return load_profile(path).unique_features
+
+def atom_overlap(path):
+    """Calculate the proportion of the features of test featuresets that were seen during training"""
+    return load_profile(path).atom_overlap
+
+def novel_combinations(path):
+    """Calculate the proportion of test featuresets that are new combinations of features seen during training"""
+    return load_profile(path).novel_combinations
 
 def train_size(path):
     """Calculate the training size for a given language"""
-    train_feats, dev_feats, test_feats = parse_files(path, -1)
-    assert(len(train_feats) != 0 and len(dev_feats) != 0 and len(test_feats) != 0)
-    return len(train_feats)
+    return load_profile(path).train_size
  
 
+def language_paths(PATH_TO_DATA):
+    """Map every family/language under a data directory to the path prefix of its split files"""
+    paths = {}
+    for language_family in sorted(l for l in os.listdir(PATH_TO_DATA) if "." not in l):
+        for language in sorted(set([f.split(".")[0] for f in os.listdir(f"{PATH_TO_DATA}/{language_family}")])):
+            paths[f"{language_family}/{language}"] = f"{PATH_TO_DATA}/{language_family}/{language}"
+    return paths
+
+
+def paradigm_rows(train, test):
+    """Get the (split, POS, lemma ID, featureset ID) rows of a language's train & test data as columns
+
+    Every distinct featureset is parsed for its POS (its first feature) only once. Besides train & test, the rows of
+    the "problematic" split are the test rows of the lemmas that appear with at least one unseen featureset in test.
+    """
+    columns = {"split": [], "pos": [], "lemma": [], "feats": []}
+    seen_feats = train.items(FEATS)
+    is_unseen = np.fromiter((feat not in seen_feats for feat in test.vocab[FEATS]), dtype=bool, count=len(test.vocab[FEATS]))[test.ids[:, FEATS]]
+    problematic = np.isin(test.ids[:, LEMMA], test.ids[is_unseen, LEMMA])
+    for split, table, rows in (("train", train, slice(None)), ("test", test, slice(None)), ("problematic", test, problematic)):
+        pos = np.asarray([feat.strip().split(";")[0] for feat in table.vocab[FEATS]], dtype=object)
+        ids = table.ids[rows]
+        columns["split"].append(np.full(len(ids), split, dtype=object))
+        columns["pos"].append(pos[ids[:, FEATS]])
+        columns["lemma"].append(ids[:, LEMMA])
+        columns["feats"].append(ids[:, FEATS])
+    return {name: np.concatenate(parts) for name, parts in columns.items()}
+
+
+def paradigm_statistics(paths, train_split="trn", test_split="tst", cache_dir=None):
+    """Get the paradigm sizes of every POS in the train, test & problematic (see paradigm_rows) data of every language at once
+
+    paths maps a label for each language (e.g. from language_paths) to the path prefix of its split files. Returns a
+    tidy frame with the mean, (population) stdev, max & number of the paradigm sizes of every (Language, split, POS).
+    As in investigate_feature_overlap, only the POS attested in a language's train data are kept.
+    """
+    return table_paradigm_statistics((language, read_unimorph(f"{path}.{train_split}", cache_dir), read_unimorph(f"{path}.{test_split}", cache_dir))
+        for language, path in paths.items())
+
+
+def table_paradigm_statistics(tables):
+    """Get the same statistics as paradigm_statistics from (label, train, test) triples of languages that are already read in"""
+    frames = [pd.DataFrame({"Language": language, **paradigm_rows(train, test)}) for language, train, test in tables]
+    df = pd.concat(frames, ignore_index=True)
+    # A paradigm is the set of featuresets of a lemma within a POS
+    sizes = df.groupby(["Language", "split", "pos", "lemma"], sort=False)["feats"].nunique()
+    grouped = sizes.groupby(level=["Language", "split", "pos"], sort=False)
+    # Take the mean & stdev with NumPy over the sizes in order of first appearance, exactly as over a list of the paradigm sizes of the POS
+    stats = pd.DataFrame({"mean": grouped.agg(lambda x: np.average(x.to_numpy())), "stdev": grouped.agg(lambda x: np.std(x.to_numpy())),
+        "max": grouped.max(), "n": grouped.size()}).reset_index()
+    trained = stats.loc[stats["split"] == "train", ["Language", "pos"]]
+    return stats.merge(trained, on=["Language", "pos"]).rename(columns={"split": "Split", "pos": "POS"})
+
+
 def investigate_feature_overlap(path, verbose = True):
     """Helper function to investigate the feature overlap"""
-    
-    def get_pos_lemma_feats(feats, lemmas):
-        """Inner helper function to extract a dictionary mapping POS to lemmas to features"""
-        POS_lemmas_feats = {}
-        for feat, lemma in zip(feats, lemmas):
-            POS = feat.strip().split(";")[0]
-            if POS not in POS_lemmas_feats:
-                POS_lemmas_feats[POS] = {}
-            if lemma not in POS_lemmas_feats[POS]:
-                POS_lemmas_feats[POS][lemma] = set()
-            POS_lemmas_feats[POS][lemma].add(feat)
-        return POS_lemmas_feats
-            
-        
-    def get_paradigm_sizes(lemmas_to_feats):
-        """Inner helper function to get the mean and standard deviation of the paradigm sizes for a POS"""
-        paradigm_sizes = np.asarray([len(x) for x in lemmas_to_feats.values()])
-        mean = np.average(paradigm_sizes)
-        stdev = np.std(paradigm_sizes)
-        return mean, stdev
-        
-    # Extract the lemmas and features for the train, dev, and test sets 
-    train_feats, dev_feats, test_feats = parse_files(path, -1)
-    train_lemmas, dev_lemmas, test_lemmas = parse_files(path, 0)
-    
-    # Get dictionaries mapping POS to lemmas to features for train & test 
-    POS_train = get_pos_lemma_feats(train_feats, train_lemmas)
-    POS_test = get_pos_lemma_feats(test_feats, test_lemmas)
-    
-    # Collect all lemmas that appear with at least one unseen featureset in test
-    # We use lemmas because a single lemma often appears with a great number of unseen features 
-    seen_feats = set(train_feats)
-    relevant_lemmas = set()
-    for feat, lemma in zip(test_feats, test_lemmas):
-        if feat not in seen_feats: 
-            relevant_lemmas.add(lemma)
-            
-    # Iterate through each POS that was seen in training 
+    # Reuse the language's profile, so its files are only read once across all of the metrics
+    profile = load_profile(path)
+    stats = table_paradigm_statistics([(path, profile.train, profile.test)])
     results = {}
-    for POS in POS_train:
+    # Iterate through each POS that was seen in training
+    for POS in stats.loc[stats["Split"] == "train", "POS"]:
+        by_split = {row.Split: row for row in stats[stats["POS"] == POS].itertuples()}
         results[POS] = {}
-        # Get the mean paradigm size and variation in the paradigm size for the training data 
-        mean_size_train, stdev_train = get_paradigm_sizes(POS_train[POS])
+        train = by_split["train"]
         if verbose:
-            print(f"POS: {POS}\n\t mean train paradigm size:\t {mean_size_train :.3f}, (stdev: {stdev_train :.3f}, n = {len(POS_train[POS])}, max = {max([len(x) for x in POS_train[POS].values()])})")
-        results[POS]["train"] = (mean_size_train, stdev_train, max([len(x) for x in POS_train[POS].values()]))
+            print(f"POS: {POS}\n\t mean train paradigm size:\t {train.mean :.3f}, (stdev: {train.stdev :.3f}, n = {train.n}, max = {train.max})")
+        results[POS]["train"] = (train.mean, train.stdev, train.max)
 
-        # If that POS was attested in test, then also calculate the overall test size 
-        if POS in POS_test:
-            mean_size_test, stdev_test = get_paradigm_sizes(POS_test[POS])
+        # If that POS was attested in test, then also report the test paradigm sizes
+        if "test" in by_split:
+            test = by_split["test"]
             if verbose:
-                print(f"\t mean test paradigm size:\t {mean_size_test :.3f}, (stdev: {stdev_test :.3f}, n = {len(POS_test[POS])})")
-            results[POS]["test"] = (mean_size_test, stdev_test, max([len(x) for x in POS_test[POS].values()]))
+                print(f"\t mean test paradigm size:\t {test.mean :.3f}, (stdev: {test.stdev :.3f}, n = {test.n})")
+            results[POS]["test"] = (test.mean, test.stdev, test.max)
 
-            # If there are any unattested features for this POS, get them and find the relevant sizes 
-            relevant_pairs = {k: v for k, v in POS_test[POS].items() if k in relevant_lemmas}
-            if relevant_pairs:
-                mean_size_relevant, stdev_relevant = get_paradigm_sizes(relevant_pairs)
+            # If there are any lemmas with unattested features for this POS, report their sizes
+            if "problematic" in by_split:
+                problematic = by_split["problematic"]
                 if verbose:
-                    print(f"\t mean problematic lemma size:\t {mean_size_relevant :.3f}, (stdev: {stdev_relevant :.3f}, n = {len(relevant_pairs)})")
-                results[POS]["problematic"] = (mean_size_relevant, stdev_relevant)
+                    print(f"\t mean problematic lemma size:\t {problematic.mean :.3f}, (stdev: {problematic.stdev :.3f}, n = {problematic.n})")
+                results[POS]["problematic"] = (problematic.mean, problematic.stdev)
             elif verbose:
                 print("\t no problematic lemmas for this POS")
         elif verbose:
             print("\t POS not attested in test")
         if verbose:
-            print("\n")    
-
-    return results  
-
-
-
-
+            print("\n")
 
+    return results
@@ -0,0 +1,107 @@
+import multiprocessing
+import numpy as np
+from scipy import stats
+
+
+def _pearson_rows(x, y):
+    """Pearson's R between matching rows of x and y"""
+    x = x - x.mean(axis=-1, keepdims=True)
+    y = y - y.mean(axis=-1, keepdims=True)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return (x * y).sum(axis=-1) / np.sqrt((x * x).sum(axis=-1) * (y * y).sum(axis=-1))
+
+def _spearman_rows(x, y):
+    """Spearman between matching rows of x and y"""
+    return _pearson_rows(stats.rankdata(x, axis=-1), stats.rankdata(y, axis=-1))
+
+STATISTICS = {"pearson": _pearson_rows, "spearman": _spearman_rows}
+
+
+def _permutation_chunk(args):
+    """Correlate x with chunk_size permutations of y"""
+    x, y, statistic, chunk_size, seed = args
+    rng = np.random.default_rng(seed)
+    return STATISTICS[statistic](x[None, :], rng.permuted(np.tile(y, (chunk_size, 1)), axis=1))
+
+def _bootstrap_correlation_chunk(args):
+    """Correlate chunk_size bootstrap resamples of the (x, y) pairs"""
+    x, y, statistic, chunk_size, seed = args
+    rng = np.random.default_rng(seed)
+    indices = rng.integers(0, len(x), size=(chunk_size, len(x)))
+    return STATISTICS[statistic](x[indices], y[indices])
+
+def _sign_flip_chunk(args):
+    """Mean paired difference under chunk_size random sign flips"""
+    differences, _, _, chunk_size, seed = args
+    rng = np.random.default_rng(seed)
+    signs = rng.choice(np.array([-1., 1.]), size=(chunk_size, len(differences)))
+    return (signs * differences).mean(axis=1)
+
+def _bootstrap_mean_chunk(args):
+    """Mean paired difference of chunk_size bootstrap resamples"""
+    differences, _, _, chunk_size, seed = args
+    rng = np.random.default_rng(seed)
+    return differences[rng.integers(0, len(differences), size=(chunk_size, len(differences)))].mean(axis=1)
+
+
+def resample(chunk_function, x, y, statistic, n_resamples, chunk_size, seed, jobs):
+    """Run n_resamples replicates in chunks of at most chunk_size, optionally spread over processes
+
+    Every chunk gets its own child of the seed's SeedSequence, so the replicates are the same whatever the number of jobs.
+    """
+    sizes = [min(chunk_size, n_resamples - start) for start in range(0, n_resamples, chunk_size)]
+    seed = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+    seeds = seed.spawn(len(sizes))
+    tasks = [(x, y, statistic, size, child) for size, child in zip(sizes, seeds)]
+    if jobs > 1:
+        with multiprocessing.Pool(jobs) as pool:
+            return np.concatenate(pool.map(chunk_function, tasks))
+    return np.concatenate([chunk_function(task) for task in tasks])
+
+
+def percentile_interval(replicates, confidence):
+    """Get the percentile confidence interval from the bootstrap replicates"""
+    alpha = (1 - confidence) / 2
+    return tuple(np.nanquantile(replicates, [alpha, 1 - alpha]))
+
+
+def permutation_test(x, y, statistic="pearson", n_resamples=10000, chunk_size=1000, seed=None, jobs=1):
+    """Two-sided permutation test of the correlation between x and y, returning the correlation & its p-value"""
+    x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+    observed = STATISTICS[statistic](x, y)
+    replicates = resample(_permutation_chunk, x, y, statistic, n_resamples, chunk_size, seed, jobs)
+    # Count the observed correlation as one of the permutations, so that p is never 0
+    pvalue = (np.count_nonzero(np.abs(replicates) >= np.abs(observed) - 1e-12) + 1) / (n_resamples + 1)
+    return observed, pvalue
+
+
+def bootstrap_correlation(x, y, statistic="pearson", n_resamples=10000, confidence=0.95, chunk_size=1000, seed=None, jobs=1):
+    """Bootstrap the correlation between x and y over languages, returning the correlation & its confidence interval"""
+    x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+    observed = STATISTICS[statistic](x, y)
+    replicates = resample(_bootstrap_correlation_chunk, x, y, statistic, n_resamples, chunk_size, seed, jobs)
+    return observed, percentile_interval(replicates, confidence)
+
+
+def paired_gap_test(seen, unseen, n_resamples=10000, confidence=0.95, chunk_size=1000, seed=None, jobs=1):
+    """Test the mean per-language gap between seen & unseen accuracy
+
+    Returns the mean gap, its bootstrap confidence interval, and the p-value of a sign-flip permutation test.
+    Languages where either accuracy is missing (e.g. no unseen lemmas in test) are dropped.
+    """
+    differences = np.asarray(seen, dtype=float) - np.asarray(unseen, dtype=float)
+    differences = differences[~np.isnan(differences)]
+    observed = differences.mean()
+    bootstrap_seed, flip_seed = np.random.SeedSequence(seed).spawn(2)
+    bootstrapped = resample(_bootstrap_mean_chunk, differences, None, None, n_resamples, chunk_size, bootstrap_seed, jobs)
+    flipped = resample(_sign_flip_chunk, differences, None, None, n_resamples, chunk_size, flip_seed, jobs)
+    pvalue = (np.count_nonzero(np.abs(flipped) >= np.abs(observed) - 1e-12) + 1) / (n_resamples + 1)
+    return observed, percentile_interval(bootstrapped, confidence), pvalue
+
+
+def seen_unseen_accuracy(df, prefix="SIGMORPHON"):
+    """Get the per-language seen & unseen lemma test accuracies from the replication table (NaN where there are none)"""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        seen = 100 * df[f"{prefix}_seen_correct"].to_numpy(dtype=float) / df[f"{prefix}_seen_lemmas_test"].to_numpy(dtype=float)
+        unseen = 100 * df[f"{prefix}_unseen_correct"].to_numpy(dtype=float) / df[f"{prefix}_unseen_lemmas_test"].to_numpy(dtype=float)
+    return seen, unseen
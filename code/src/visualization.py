@@ -67,6 +67,75 @@ def run_stats(df, col1, col2):
     for name, stat in [("Pearson's R", pearson), ("Spearman", spearman), ("Kendall's Tau", kendall_tau)]:
         print(f"{name}:\t{stat.statistic :.3f},\t p = {stat.pvalue}")
         
+def metric_matrix(PATH_TO_DATA, functs):
+    """Build a languages x metrics frame, running every metric function over every language"""
+    rows = []
+    for language_family in sorted(l for l in os.listdir(PATH_TO_DATA) if "." not in l):
+        for language in sorted(set([f.split(".")[0] for f in os.listdir(f"{PATH_TO_DATA}/{language_family}")])):
+            path = f"{PATH_TO_DATA}/{language_family}/{language}"
+            rows.append({"Language": f"{language_family}/{language}", "Family": language_family, **{funct.__name__: funct(path) for funct in functs}})
+    return pd.DataFrame(rows).set_index("Language")
+
+def pairwise_correlations(X):
+    """Compute Pearson's R, Spearman & Kendall's Tau (tau-b) with their p-values between every pair of columns of X at once"""
+    n, m = X.shape
+
+    def pearson(Z):
+        """Inner helper function to correlate every pair of columns through a single matrix product"""
+        Z = Z - Z.mean(axis=0)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            Z = Z / np.linalg.norm(Z, axis=0)
+            r = np.clip(Z.T @ Z, -1, 1)
+            t = r * np.sqrt((n - 2) / (1 - r**2))
+        return r, 2 * stats.t.sf(np.abs(t), n - 2)
+
+    pearson_r, pearson_p = pearson(X)
+    # Spearman is Pearson over the (tie-averaged) ranks
+    spearman_r, spearman_p = pearson(stats.rankdata(X, axis=0))
+
+    # For Kendall's Tau, sum the products of the signs of the differences of every pair of languages
+    signs = np.sign(X[:, None, :] - X[None, :, :]).reshape(n * n, m)
+    con_minus_dis = signs.T @ signs / 2
+    untied = np.abs(signs).sum(axis=0) / 2
+    with np.errstate(divide="ignore", invalid="ignore"):
+        kendall_tau = np.clip(con_minus_dis / np.sqrt(np.outer(untied, untied)), -1, 1)
+    # Asymptotic variance of con_minus_dis, corrected for ties, as in scipy.stats.kendalltau
+    ties = [counts[counts > 1] for counts in (np.unique(X[:, k], return_counts=True)[1] for k in range(m))]
+    tie0 = np.asarray([np.sum(c * (c - 1.) * (c - 2)) for c in ties])
+    tie1 = np.asarray([np.sum(c * (c - 1.) * (2*c + 5)) for c in ties])
+    tied = np.asarray([np.sum(c * (c - 1) // 2) for c in ties])
+    pairs = n * (n - 1.)
+    var = ((pairs * (2*n + 5) - tie1[:, None] - tie1[None, :]) / 18
+           + 2 * np.outer(tied, tied) / pairs + np.outer(tie0, tie0) / (9 * pairs * (n - 2)))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        kendall_p = 2 * stats.norm.sf(np.abs(con_minus_dis) / np.sqrt(var))
+    # scipy uses the exact distribution for small samples without ties, so defer to it for those few pairs
+    total = n * (n - 1) // 2
+    discordant = (total - con_minus_dis) / 2
+    exact = (tied[:, None] == 0) & (tied[None, :] == 0) & ((n <= 33) | (np.minimum(discordant, total - discordant) <= 1))
+    for j, k in zip(*np.nonzero(np.triu(exact, 1))):
+        kendall_p[j, k] = kendall_p[k, j] = stats.kendalltau(X[:, j], X[:, k]).pvalue
+
+    return {"pearson": pearson_r, "pearson_p": pearson_p, "spearman": spearman_r, "spearman_p": spearman_p,
+            "kendall_tau": kendall_tau, "kendall_p": kendall_p}
+
+def correlation_matrix(df, cols=None, by=None):
+    """Run every correlation for every pair of metric columns, over all languages & (optionally) each group of the by column"""
+    cols = [c for c in df.columns if c != by and pd.api.types.is_numeric_dtype(df[c])] if cols is None else list(cols)
+    groups = [("All", df)] + (list(df.groupby(by)) if by is not None else [])
+    j, k = np.triu_indices(len(cols), 1)
+    results = []
+    for group, group_df in groups:
+        correlations = pairwise_correlations(group_df[cols].to_numpy(dtype=float))
+        results.append(pd.DataFrame({
+            "Group": group,
+            "x": [cols[i] for i in j],
+            "y": [cols[i] for i in k],
+            "n": len(group_df),
+            **{name: values[j, k] for name, values in correlations.items()},
+        }))
+    return pd.concat(results, ignore_index=True)
+        
 def run_plotting(df, col1, col2, xlabel=None, ylabel=None, title=None):
     """Here's a helper function to handle SNS for us"""
     
@@ -128,11 +197,11 @@ def difference_density(PATH_TO_GOLDMAN_DATA, PATH_TO_SIGMORPHON20, lemmas):
         lang_dict = {}
         for f in [f for f in os.listdir(path) if "." not in f]:
             for lang in set([l.strip().split(".")[0] for l in os.listdir(f"{path}/{f}")]):
-                train, _, _, = parse_files(f"{path}/{f}/{lang}", 0)
+                profile = load_profile(f"{path}/{f}/{lang}")
                 if lemmas:
-                    lang_dict[lang] = len(set(train))
+                    lang_dict[lang] = profile.unique_lemmas
                 else:
-                    lang_dict[lang] = len(train)
+                    lang_dict[lang] = len(profile.train)
         return lang_dict 
     
     # Get the dictionaries for the Goldman & SIGMORPHON data
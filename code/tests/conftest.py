@@ -0,0 +1,4 @@
+import os, sys
+
+# The scripts import each other as top-level modules from the code directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,33 @@
+import json
+import numpy as np
+import pandas as pd
+import evaluation
+from corpus import write_rows
+
+
+def test_empty_decode_file_has_no_rows(tmp_path):
+    write_rows(f"{tmp_path}/syn.trn", [("a", "ab", "V;PST")])
+    write_rows(f"{tmp_path}/syn.ftune", [("b", "bb", "V;PST")])
+    write_rows(f"{tmp_path}/syn.tst", [("c", "cb", "V;PST")])
+    res_file = tmp_path / "syn..decode.tsv"
+    res_file.touch()
+    assert len(evaluation.read_decode(str(res_file)).dist) == 0
+    scores = evaluation.evaluate_language(f"{tmp_path}/syn", str(res_file))
+    assert np.isnan(scores["seen_pct_t"]) and scores["seen_n_t"] == 0
+
+
+def test_batch_writes_profile_and_errors(tmp_path):
+    for seed in ("1", "2"):
+        write_rows(f"{tmp_path}/splits/{seed}/romance/syn.trn", [("a", "ab", "V;PST")])
+        write_rows(f"{tmp_path}/splits/{seed}/romance/syn.ftune", [("b", "bb", "V;PST")])
+        write_rows(f"{tmp_path}/splits/{seed}/romance/syn.tst", [("a", "ac", "V;PRS"), ("c", "cb", "V;PST")])
+        write_rows(f"{tmp_path}/res/{seed}/romance/syn..decode.tsv", [("prediction", "target", "loss", "dist"), ("a c", "a c", "0.1", "0"), ("c c", "c b", "2.0", "1")])
+    out_path = f"{tmp_path}/results.csv"
+    evaluation.evaluate_tree(f"{tmp_path}/splits", f"{tmp_path}/res", out_path, profile=True, errors=True)
+    errors = pd.read_csv(f"{tmp_path}/results.errors.csv")
+    assert sorted(set(errors["seed"])) == [1, 2] and errors["n"].sum() == 4
+    confusions = pd.read_csv(f"{tmp_path}/results.confusions.csv")
+    assert confusions[["target", "prediction"]].drop_duplicates().values.tolist() == [["b", "c"]]
+    with open(f"{tmp_path}/results.profile.jsonl") as f:
+        records = [json.loads(line) for line in f]
+    assert [(r["seed"], r["phase"], r["test"]) for r in records] == [("1", "evaluate", 2), ("2", "evaluate", 2)]
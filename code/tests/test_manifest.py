@@ -0,0 +1,38 @@
+import io, contextlib
+import manifest
+from corpus import write_rows
+
+
+def write_split(directory, lang):
+    """Write the three split files of a language, returning their paths"""
+    paths = [f"{directory}/{lang}.{split}" for split in ("trn", "ftune", "tst")]
+    for path in paths:
+        write_rows(path, [("lemma", "form", "N;SG")])
+    return paths
+
+
+def check(root):
+    """Run check_tree, returning its count & the lines it printed"""
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        num_stale = manifest.check_tree(str(root))
+    return num_stale, out.getvalue().splitlines()
+
+
+def test_check_tree_reports_splits_without_manifest(tmp_path):
+    write_split(tmp_path / "1" / "germanic", "ang")
+    num_stale, lines = check(tmp_path)
+    assert num_stale == 1
+    assert lines[0].startswith("1/germanic\tang\tunknown")
+
+
+def test_check_tree_reports_uncovered_and_changed_splits(tmp_path):
+    directory = tmp_path / "1" / "germanic"
+    written = write_split(directory, "ang")
+    manifest.update_manifest(str(directory), "ang", manifest.make_entry(1, {}, {}, str(directory), written))
+    assert check(tmp_path) == (0, [])
+    write_split(directory, "dan")
+    write_rows(written[0], [])
+    num_stale, lines = check(tmp_path)
+    assert num_stale == 2
+    assert lines == ["1/germanic\tang\toutput ang.trn has changed", "1/germanic\tdan\tunknown: dan.ftune, dan.trn, dan.tst not covered by any manifest entry"]
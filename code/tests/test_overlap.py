@@ -0,0 +1,11 @@
+import numpy as np
+import overlap
+
+
+def test_weighted_permutation_draws_unweighted_positions_last_in_random_order():
+    rng = np.random.default_rng(0)
+    draws = [overlap.weighted_permutation([5, 1, 0, 0, 0, 0, 0, 0], 6, rng).tolist() for _ in range(100)]
+    assert all(sorted(draw[:2]) == [0, 1] for draw in draws)
+    assert all(len(set(draw)) == 6 for draw in draws)
+    # Taking the unweighted positions in file order would always give [2, 3, 4, 5]
+    assert len({tuple(draw[2:]) for draw in draws}) > 1
@@ -0,0 +1,177 @@
+import os, io, random, hashlib, contextlib
+import pytest
+import benchmark, make_splits, lemma_overlap_splits, splits
+from corpus import write_rows, LEMMA, FEATS
+
+# The splits of the synthetic corpus below, pinned so that any change to the splits made for a fixed seed shows up.
+# The legacy partition search must keep making the splits lemma_overlap_splits has made since every language got its own seed.
+LEGACY_SPLITS = {
+    "lemma": "351d11fc0d8db9b64c9d47f12949f1ec24d9f883",
+    "lemma_start1": "483f74438c00aa152d0a29afc3ba9c0c3a3c6d07",
+    "feats": "0c11349a908f9050cb47f335b299d3d12e96ca44",
+    "weighted": "ed527bca0b6eb133647dd836191ab55a401a1cc2",
+}
+FAST_SPLITS = {
+    "lemma": "4192c707d77da3f27fe3b1d2b9bdeaa257ba613e",
+    "lemma_start1": "4192c707d77da3f27fe3b1d2b9bdeaa257ba613e",
+    "feats": "82a84092735746c5dfcae6baefa581a0b925122c",
+    "weighted": "4fc6360d8ea8909474364bcf621e44cca6ea056d",
+}
+# Modes without a partition search
+OTHER_SPLITS = {
+    "joint": "e6096aad4b6e246e5fab5af2d8adf5ec50a897ee",
+    "folds": "a02d60f60219ab3ff1f408645591755bbea74159",
+}
+MAKE_SPLITS = "623bd1cc121404d5f1e24cc30c04ce56f76f1b11"
+
+CASES = {
+    "lemma": {},
+    "lemma_start1": {"start1": True},
+    "feats": {"overlap_item": FEATS},
+    "weighted": {"weighted": True},
+    "joint": {"overlap_item": lemma_overlap_splits.BOTH, "feat_overlap_ratio": .8},
+    "folds": {"folds": 4},
+}
+
+
+@pytest.fixture(scope="module")
+def corpus_dir(tmp_path_factory):
+    """A synthetic language with a frequency column, in the train, dev & gold test files lemma_overlap_splits reads & the files make_splits reads"""
+    root = tmp_path_factory.mktemp("data")
+    triples = benchmark.synthetic_unimorph(3000, seed=0)
+    n = len(triples)
+    write_rows(f"{root}/train/synthetic/syn.trn", triples[:int(.8 * n)])
+    write_rows(f"{root}/train/synthetic/syn.dev", triples[int(.8 * n):int(.9 * n)])
+    write_rows(f"{root}/gold/syn.tst", triples[int(.9 * n):])
+    write_rows(f"{root}/syn.freq", triples)
+    write_rows(f"{root}/syn.raw", [t[:3] for t in triples])
+    # A frequency list without any of the triples
+    write_rows(f"{root}/nofreq/syn.freq", [])
+    return root
+
+
+def tree_digest(outdir):
+    """Hash the names & contents of the split files under outdir"""
+    digest = hashlib.sha1()
+    for directory, _, files in sorted(os.walk(outdir)):
+        for fname in sorted(files):
+            if fname not in ("manifest.json", "profile.jsonl", "log.tsv"):
+                path = os.path.join(directory, fname)
+                digest.update(os.path.relpath(path, outdir).encode())
+                with open(path, "rb") as f:
+                    digest.update(f.read())
+    return digest.hexdigest()
+
+
+def split(corpus_dir, outdir, overlap_item=LEMMA, start1=False, **kwargs):
+    """Split the synthetic language with lemma_overlap_splits for seed 1, returning the hash of the splits"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        lemma_overlap_splits.main(f"{corpus_dir}/train", f"{corpus_dir}/gold", 1200, 300, overlap_item, .2, .125, 1, str(outdir), start1, **kwargs)
+    return tree_digest(outdir)
+
+
+def reference_subsample(triples, overlappable, numsample, overlap_ratio, overlap_item):
+    """subsample as lemma_overlap_splits first had it, over (lemma, inflection, features) triples"""
+    overlaptriples = [triple for triple in triples if triple[overlap_item] in overlappable]
+    nonoverlaptriples = [triple for triple in triples if triple[overlap_item] not in overlappable]
+    random.shuffle(overlaptriples)
+    random.shuffle(nonoverlaptriples)
+    num_overlappable = int(numsample * overlap_ratio)
+    num_nonoverlappable = numsample - num_overlappable
+    return overlaptriples[:num_overlappable] + nonoverlaptriples[:num_nonoverlappable]
+
+
+def reference_sample(line_dict, triples, trainsize, testsize, ftuneprop, overlap_item, overlap_ratio, start1):
+    """controlled_overlap_sample as lemma_overlap_splits first had it, growing the partition one item at a time"""
+    all_items = sorted(line_dict.keys())
+    random.shuffle(triples)
+    random.shuffle(all_items)
+    partition = 1 if start1 else int(overlap_ratio * len(all_items))
+    total_overlappable = 0
+    overlappable = {}
+    while total_overlappable < trainsize + overlap_ratio * testsize and len(overlappable) < len(all_items):
+        overlappable = set(all_items[:partition])
+        overlaptriples = [triple for triple in triples if triple[overlap_item] in overlappable]
+        random.shuffle(overlaptriples)
+        trainsample = overlaptriples[:trainsize]
+        items_in_train = set(triple[overlap_item] for triple in trainsample)
+        total_overlappable = len([t for t in triples if t[overlap_item] in items_in_train])
+        partition += 1
+    remaining = sorted(set(triples).difference(trainsample))
+    random.shuffle(trainsample)
+    cutoff = int(ftuneprop * trainsize)
+    test = reference_subsample(remaining, items_in_train, testsize, overlap_ratio, overlap_item)
+    return trainsample[cutoff:], trainsample[:cutoff], test
+
+
+def read_synthetic(corpus_dir, overlap_item):
+    """Read the synthetic language into a corpus & its item index, as lemma_overlap_splits does"""
+    return lemma_overlap_splits.read_corpus(f"{corpus_dir}/train/synthetic/syn", f"{corpus_dir}/gold/syn", overlap_item)
+
+
+# (train size, test size, overlap item, overlap ratio, start1)
+SAMPLES = [(1200, 300, LEMMA, .2, False), (1200, 300, LEMMA, .5, True), (1200, 300, FEATS, .2, False)]
+# Train & the overlap of test need more triples than the corpus has, so train is drawn from every item
+UNDERSIZED = (2950, 300, LEMMA, .2, False)
+
+
+@pytest.mark.parametrize("trainsize, testsize, overlap_item, overlap_ratio, start1", SAMPLES + [UNDERSIZED])
+def test_legacy_partition_matches_reference(corpus_dir, trainsize, testsize, overlap_item, overlap_ratio, start1):
+    corpus, line_dict = read_synthetic(corpus_dir, overlap_item)
+    triples = corpus.decode(range(len(corpus)))
+    reference_dict = {}
+    for triple in triples:
+        reference_dict.setdefault(triple[overlap_item], set()).add(triple)
+    random.seed("reference")
+    expected = reference_sample(reference_dict, triples, trainsize, testsize, .125, overlap_item, overlap_ratio, start1)
+    random.seed("reference")
+    with contextlib.redirect_stdout(io.StringIO()):
+        sample = lemma_overlap_splits.controlled_overlap_sample(corpus, line_dict, list(range(len(corpus))), trainsize, testsize, .125, overlap_item,
+            overlap_ratio, start1, legacy_partition=True)
+    assert [corpus.decode(rows) for rows in sample] == list(expected)
+
+
+@pytest.mark.parametrize("trainsize, testsize, overlap_item, overlap_ratio, start1", SAMPLES)
+def test_fast_partition_overlap(corpus_dir, trainsize, testsize, overlap_item, overlap_ratio, start1):
+    corpus, line_dict = read_synthetic(corpus_dir, overlap_item)
+    split = splits.Split.sample(corpus, line_dict, "synthetic", "syn", trainsize, testsize, overlap_item, overlap_ratio, start1=start1)
+    assert (len(split.train) + len(split.ftune), len(split.test)) == (trainsize, testsize)
+    # validate fails on any triple in both train & test
+    with contextlib.redirect_stdout(io.StringIO()):
+        test_overlap, _ = split.validate(overlap_item)
+    assert test_overlap == pytest.approx(100 * int(overlap_ratio * testsize) / testsize)
+
+
+def test_fast_partition_undersized(corpus_dir):
+    trainsize, testsize, overlap_item, overlap_ratio, start1 = UNDERSIZED
+    corpus, line_dict = read_synthetic(corpus_dir, overlap_item)
+    split = splits.Split.sample(corpus, line_dict, "synthetic", "syn", trainsize, testsize, overlap_item, overlap_ratio, start1=start1)
+    assert (len(split.train) + len(split.ftune), len(split.test)) == (trainsize, len(corpus) - trainsize)
+    assert not set(split.test.tolist()) & set(split.train.tolist() + split.ftune.tolist())
+
+
+@pytest.mark.parametrize("case", sorted(LEGACY_SPLITS))
+def test_legacy_partition_splits(corpus_dir, tmp_path, case):
+    assert split(corpus_dir, tmp_path, legacy_partition=True, **CASES[case]) == LEGACY_SPLITS[case]
+
+
+@pytest.mark.parametrize("case", sorted(FAST_SPLITS))
+def test_fast_partition_splits(corpus_dir, tmp_path, case):
+    assert split(corpus_dir, tmp_path, **CASES[case]) == FAST_SPLITS[case]
+
+
+@pytest.mark.parametrize("case", sorted(OTHER_SPLITS))
+def test_other_splits(corpus_dir, tmp_path, case):
+    assert split(corpus_dir, tmp_path, **CASES[case]) == OTHER_SPLITS[case]
+
+
+def test_weighted_without_frequencies_is_unweighted(corpus_dir, tmp_path):
+    assert split(corpus_dir, tmp_path, weighted=True, freq_path=f"{corpus_dir}/nofreq") == FAST_SPLITS["lemma"]
+
+
+def test_make_splits(corpus_dir, tmp_path):
+    for strategy in ("naive_uniform", "naive_weighted", "overlap_aware"):
+        os.makedirs(tmp_path / strategy)
+    with contextlib.redirect_stdout(io.StringIO()):
+        make_splits.main(f"{corpus_dir}/syn.freq", f"{corpus_dir}/syn.raw", str(tmp_path), 200, 800, 20, 80, 150, 150, .5, "syn", "1")
+    assert tree_digest(tmp_path) == MAKE_SPLITS